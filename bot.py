@@ -2,11 +2,15 @@ import asyncio
 import json
 import locale
 import logging
+import time
 from datetime import datetime
 from sys import platform
 
 from discord.ext import commands
 
+from core import metrics
+from core.http import http_client
+
 try:
     import uvloop
 except ImportError:
@@ -19,11 +23,11 @@ def load_config():
     return json.loads(open('config.json').read())
 
 
-def load_logging():
+def load_logging(filename='bot.log'):
     logger = logging.getLogger('discord')
     logger.setLevel(logging.INFO)
     handler = logging.FileHandler(
-        filename='bot.log', encoding='utf-8', mode='w')
+        filename=filename, encoding='utf-8', mode='w')
     handler.setFormatter(logging.Formatter(
         '%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
     logger.addHandler(handler)
@@ -38,9 +42,10 @@ cogs = [
 ]
 
 
-def main():
+def main(worker=0, shard_ids=None, shard_count=None):
     config = load_config()
-    load_logging()
+    # Worker processes each keep their own log file
+    load_logging('bot.log' if shard_ids is None else f'bot.{worker}.log')
 
     if platform == 'win32':
         locale.setlocale(locale.LC_ALL, 'US')
@@ -53,7 +58,18 @@ def main():
         command_prefix = '!'
 
     description = 'A discord bot to retrieve twitch.tv API data'
-    bot = commands.Bot(command_prefix=command_prefix, description=description)
+    if shard_count is not None:
+        bot = commands.AutoShardedBot(
+            command_prefix=command_prefix, description=description, shard_ids=shard_ids, shard_count=shard_count)
+    else:
+        bot = commands.Bot(command_prefix=command_prefix, description=description)
+    bot.http_client = http_client
+    # Only the primary worker runs the stream poller and the EventSub receiver
+    bot.worker = worker
+
+    command_started = metrics.Counter('bot_commands_started_total', 'Commands invoked', ['command'])
+    command_latency = metrics.Histogram(
+        'bot_command_duration_seconds', 'Latency of successfully completed commands', ['command'])
 
     @bot.event
     async def on_ready():
@@ -65,12 +81,48 @@ def main():
         if not hasattr(bot, 'bot_uptime'):
             bot.bot_uptime = datetime.utcnow()
 
+        # Persistent caches load from disk in the background before anything reads them
+        from core.cache import start_persistent_caches
+        from core.poller import poller
+        start_persistent_caches(bot.loop)
+
+        if bot.worker == 0:
+            from core.eventsub import eventsub
+            poller.start(bot.loop)
+            if eventsub.enabled:
+                bot.loop.create_task(eventsub.start(bot))
+
+        from core.follows import follower_index
+        # Other workers' writes only reach this worker's reverse index through a rebuild
+        follower_index.start(bot.loop, rebuild_interval=600 if config['bot'].get('processes', 1) > 1 else None)
+
+        from core.hoststats import sampler
+        from core.watchdog import watchdog
+        watchdog.start(bot.loop)
+        sampler.start(bot.loop)
+
+        if not hasattr(bot, 'metrics_server'):
+            bot.metrics_server = None
+            if config.get('metrics', {}).get('enabled'):
+                bot.metrics_server = await metrics.start_server(
+                    config['metrics'].get('host', '127.0.0.1'), config['metrics'].get('port', 9090) + bot.worker)
+
         for cog in cogs:
             try:
                 bot.load_extension(cog)
             except Exception as e:
                 print(f'Failed to load {cog}\n{type(type(e).__name__)}: {e}')
 
+    @bot.event
+    async def on_command(ctx):
+        ctx.started_at = time.perf_counter()
+        command_started.inc(ctx.command.qualified_name)
+
+    @bot.event
+    async def on_command_completion(ctx):
+        if hasattr(ctx, 'started_at'):
+            command_latency.observe(time.perf_counter() - ctx.started_at, ctx.command.qualified_name)
+
     @bot.event
     async def on_message(message):
         if message.author.bot:
@@ -82,4 +134,16 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    config = load_config()
+    processes = config['bot'].get('processes', 1)
+    shard_count = config['bot'].get('shard_count')
+
+    if shard_count is not None and processes > shard_count:
+        # Every worker process needs at least one shard to run
+        raise SystemExit(f'bot.processes ({processes}) cannot be more than bot.shard_count ({shard_count})')
+
+    if processes > 1:
+        from core.supervisor import Supervisor
+        Supervisor(main, shard_count or processes, processes).run()
+    else:
+        main(shard_count=shard_count)
@@ -5,34 +5,46 @@ import socket
 from datetime import timedelta
 
 import discord
-import psutil
 import uptime
 from discord.ext import commands
 
+from core.hoststats import sampler
+from core.scheduler import scheduler
+from core.utils import caches, channel_name_loader, game_name_loader, twitch_flight, twitch_limiter
+from core.watchdog import watchdog
+
 
 class Admin:
     """
     Bot owner and admin commands
     """
 
+    MAX_BLOCKERS = 5
+
     def __init__(self, bot):
         self.bot = bot
 
     @commands.command(hidden=True)
     @commands.is_owner()
-    async def host(self, ctx):
+    async def host(self, ctx, minutes: int = 5):
         """
-        Return host server information
+        Return host server and bot process information
         """
         server_uptime_seconds = uptime.uptime()
         server_uptime = timedelta(seconds=math.floor(server_uptime_seconds))
 
-        processor = psutil.cpu_times_percent(interval=1)
-        processor_system_load = processor.system
-        processor_user_load = processor.user
-
-        memory = psutil.virtual_memory()
-        memory_load = memory.percent
+        # Rendered from the background sampler so the event loop never waits on psutil
+        count, summary = sampler.summary(minutes)
+        stats = [
+            ('CPU System Load', 'cpu_system', '%'),
+            ('CPU User Load', 'cpu_user', '%'),
+            ('Memory Load', 'memory', '%'),
+            ('Bot CPU Load', 'process_cpu', '%'),
+            ('Bot Memory', 'rss', ' MB'),
+            ('Bot Open Files', 'fds', ''),
+            ('Bot Tasks', 'tasks', ''),
+            ('Event Loop Lag', 'loop_lag', ' ms')
+        ]
 
         embed = discord.Embed()
         embed.add_field(name='Platform',
@@ -41,15 +53,119 @@ class Admin:
                         value=socket.gethostname().lower(), inline=False)
         embed.add_field(name='Host Uptime', value=str(
             server_uptime), inline=False)
-        embed.add_field(name='CPU System Load', value=str(
-            processor_system_load) + '%', inline=False)
-        embed.add_field(name='CPU User Load', value=str(
-            processor_user_load) + '%', inline=False)
-        embed.add_field(name='Memory Load', value=str(
-            memory_load) + '%', inline=False)
+        for name, field, unit in stats:
+            low, average, high = summary[field]
+            embed.add_field(
+                name=name,
+                value=f'{low:.1f}{unit} / {average:.1f}{unit} / {high:.1f}{unit}',
+                inline=False
+            )
+        embed.set_footer(text=f'Min / avg / max over {count} samples in the last {minutes} minutes')
         embed.colour = 0x738bd7
         await ctx.send(embed=embed)
 
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def blockers(self, ctx, count: int = 5):
+        """
+        List the callbacks that blocked the event loop the longest
+        """
+        embed = discord.Embed()
+        embed.add_field(name='Current Loop Lag', value=f'{watchdog.lag * 1000:.1f} ms', inline=False)
+
+        blockers = watchdog.top(max(1, min(count, self.MAX_BLOCKERS)))
+        # Stacks share what is left of Discord's 6000 character embed limit after names and footer
+        budget = min(1000, 5000 // max(1, len(blockers)))
+        for number, blocker in enumerate(blockers, start=1):
+            location = blocker.location[-200:]
+            keep = max(0, budget - len(location) - 8)
+            stack = blocker.stack[-keep:] if keep else ''
+            embed.add_field(
+                name=f'{number}. {blocker.duration * 1000:.0f} ms at {blocker.timestamp:%Y-%m-%d %H:%M:%S}',
+                value=f'{location}\n```{stack}```',
+                inline=False
+            )
+        if not blockers:
+            embed.add_field(name='Blockers', value='No blocking callbacks recorded', inline=False)
+        embed.set_footer(text=f'Requested by {ctx.message.author}')
+        embed.colour = 0x738bd7
+        await ctx.send(embed=embed)
+
+    @commands.group(hidden=True)
+    @commands.is_owner()
+    async def cache(self, ctx):
+        """
+        Return twitch lookup cache, request coalescing and rate limit statistics
+        """
+        if ctx.invoked_subcommand is None:
+            embed = discord.Embed()
+            for name, cache in caches.items():
+                stats = cache.stats()
+                embed.add_field(
+                    name=name,
+                    value=f'Size: {stats["size"]}/{stats["maxsize"]} \n'
+                          f'Hits: {stats["hits"]} \n'
+                          f'Misses: {stats["misses"]} \n'
+                          f'Hit Rate: {stats["hit_rate"]:.1f}%',
+                    inline=False
+                )
+            flight = twitch_flight.stats()
+            embed.add_field(
+                name='requests',
+                value=f'Calls: {flight["calls"]} \n'
+                      f'Deduplicated: {flight["deduplicated"]} \n'
+                      f'In Flight: {flight["in_flight"]}',
+                inline=False
+            )
+            for name, loader in (('channel_name_loader', channel_name_loader), ('game_name_loader', game_name_loader)):
+                batching = loader.stats()
+                embed.add_field(
+                    name=name,
+                    value=f'Loads: {batching["loads"]} \n'
+                          f'Batches: {batching["batches"]}',
+                    inline=False
+                )
+            limiter = twitch_limiter.stats()
+            embed.add_field(
+                name='rate_limit',
+                value=f'Remaining: {limiter["remaining"]}/{limiter["limit"]} \n'
+                      f'Queued: {limiter["queued"]}',
+                inline=False
+            )
+            fairness = scheduler.stats()
+            embed.add_field(
+                name='scheduler',
+                value=f'Cost In Use: {fairness["used"]}/{fairness["capacity"]} \n'
+                      f'Admitted: {fairness["admitted"]} \n'
+                      f'Queued: {fairness["queued"]} \n'
+                      f'Waiting: {fairness["waiting"]}',
+                inline=False
+            )
+            embed.set_footer(text=f'Requested by {ctx.message.author}')
+            embed.colour = 0x738bd7
+            await ctx.send(embed=embed)
+
+    @cache.command(hidden=True)
+    @commands.is_owner()
+    async def flush(self, ctx, name: str = None):
+        """
+        Flush twitch lookup caches
+        """
+        embed = discord.Embed()
+        embed.colour = 0x738bd7
+        embed.set_footer(text=f'Requested by {ctx.message.author}')
+
+        if name is None:
+            for cache in caches.values():
+                cache.clear()
+            embed.add_field(name='Info', value='Flushed all caches')
+        elif name in caches:
+            caches[name].clear()
+            embed.add_field(name='Info', value=f'Flushed cache {name}')
+        else:
+            embed.add_field(name='Info', value=f'Cache {name} does not exist')
+        await ctx.send(embed=embed)
+
     @commands.command(hidden=True)
     @commands.is_owner()
     async def load(self, ctx, cog: str):
@@ -118,6 +234,7 @@ class Admin:
         await ctx.send(embed=embed)
 
         await asyncio.sleep(count)
+        await self.bot.http_client.close()
         quit()
 
 
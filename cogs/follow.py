@@ -1,13 +1,19 @@
 import locale
 import textwrap
+import time
 
-import discord
 from discord.ext import commands
 from sqlalchemy import exc
 
-from core.models import session, Follows
-from core.utils import check_follows_exist, twitch_api_call, twitch_convert_timestamp, twitch_channel_uptime, \
-    retrieve_twitch_channel_id, retrieve_twitch_game, retrieve_twitch_channel_name, embed_message
+from core import db
+from core.eventsub import eventsub
+from core.follows import follower_index, follows_added, follows_removed
+from core.poller import poller
+from core.render import send_pages
+from core.scheduler import scheduler
+from core.utils import check_follows_exist, twitch_convert_timestamp, twitch_channel_uptime, \
+    retrieve_twitch_channel_id, retrieve_twitch_channel_ids, retrieve_twitch_channel_names, retrieve_twitch_follows, \
+    retrieve_twitch_game, create_embed, embed_message, gather_lookups
 
 
 class Follow:
@@ -15,9 +21,28 @@ class Follow:
     Bot commands to handle channel follows for twitch.tv
     """
 
+    # Paginated follow imports make an unknown number of requests up front
+    IMPORT_COST = 10
+    PAGE_SIZE = 20
+
     def __init__(self, bot):
         self.bot = bot
 
+    async def __before_invoke(self, ctx):
+        name = ctx.command.qualified_name
+        if name == 'follows _import':
+            await scheduler.acquire(ctx, cost=self.IMPORT_COST)
+        elif name == 'follows add':
+            # Channels are resolved in one users request per 100 names
+            await scheduler.acquire(ctx, cost=1 + (len(ctx.args) - 2) // 100)
+        elif name in ('follows live', 'follows uptime', 'follows game'):
+            # Streams are fetched 100 channels per request, games add about as many again
+            follows = await check_follows_exist(ctx.author.id, channel=None)
+            await scheduler.acquire(ctx, cost=1 + len(follows) // 100 * (2 if name == 'follows game' else 1))
+
+    async def __after_invoke(self, ctx):
+        scheduler.release(ctx)
+
     @commands.group()
     async def follows(self, ctx):
         """
@@ -26,18 +51,9 @@ class Follow:
         user_id = ctx.message.author.id
 
         if ctx.invoked_subcommand is None:
-            follows = check_follows_exist(user_id, channel=None)
-            if follows:
-                channels = []
-                for count, follow in enumerate(follows, start=1):
-                    channels.append(f'{count}. {follow.channel}')
-                embed = discord.Embed()
-                embed.add_field(name='Channel Follows',
-                                value=' \n'.join(channels))
-                embed.set_footer(text=f'Requested by {ctx.message.author}')
-                embed.colour = 0x738bd7
-                await ctx.send(embed=embed)
-            else:
+            follows = await check_follows_exist(user_id, channel=None)
+            rows = ((f'{count}. {follow.channel}',) for count, follow in enumerate(follows, start=1))
+            if await send_pages(ctx, ['Channel Follows'], rows) is None:
                 await embed_message(ctx, message_type='Error', message='No channels saved in database')
 
     @follows.command(aliases=['import'])
@@ -50,46 +66,55 @@ class Follow:
         twitch_user_id = await retrieve_twitch_channel_id(ctx, twitch_username)
 
         if twitch_user_id:
-            data = await twitch_api_call(ctx, endpoint='users/follows?from_id=', channel=twitch_user_id, params='')
-            if data:
-                objects = []
-                for follow in data['data']:
-                    channel_id = follow['to_id']
-                    channel_name = await retrieve_twitch_channel_name(ctx, channel_id)
-                    follows = check_follows_exist(user_id, channel_name)
-                    if follows:
-                        pass
-                    else:
-                        objects.append(
-                            Follows(
-                                user_id=user_id,
-                                username=username,
-                                channel=channel_name,
-                                channel_id=channel_id
-                            )
-                        )
-                if len(objects) == 0:
-                    await embed_message(
-                        ctx,
-                        message_type='Error',
-                        message='Channel follows already saved in database'
-                    )
-                else:
-                    try:
-                        session.add_all(objects)
-                        session.commit()
-                        await embed_message(
-                            ctx,
-                            message_type='Success',
-                            message=f'Imported {len(objects)} channel follows to database'
-                        )
-                    except exc.OperationalError:
-                        session.rollback()
-                        await embed_message(
-                            ctx,
-                            message_type='Error',
-                            message='Cannot save channel follows to database'
-                        )
+            status = await embed_message(
+                ctx,
+                message_type='Info',
+                message=f'Importing channel follows from {twitch_username}'
+            )
+            last_update = time.monotonic()
+
+            async def progress(count, total):
+                nonlocal last_update
+                # Discord rate limits message edits, so progress is shown at most once a second
+                if time.monotonic() - last_update >= 1:
+                    last_update = time.monotonic()
+                    await status.edit(embed=create_embed(
+                        ctx, message_type='Info', message=f'Fetched {count} of {total} channel follows'))
+
+            channel_ids = await retrieve_twitch_follows(ctx, twitch_user_id, progress)
+            if channel_ids is None:
+                return await status.edit(embed=create_embed(
+                    ctx, message_type='Error', message='Cannot retrieve channel follows'))
+
+            existing = {follow.channel_id for follow in await check_follows_exist(user_id, channel=None)}
+            channel_ids = [channel_id for channel_id in channel_ids if int(channel_id) not in existing]
+            if not channel_ids:
+                return await status.edit(embed=create_embed(
+                    ctx, message_type='Error', message='Channel follows already saved in database'))
+
+            await status.edit(embed=create_embed(
+                ctx, message_type='Info', message=f'Resolving {len(channel_ids)} channel names'))
+            names = await retrieve_twitch_channel_names(ctx, channel_ids)
+            rows = [
+                {'user_id': user_id, 'username': username, 'channel': names[channel_id], 'channel_id': int(channel_id)}
+                for channel_id in channel_ids if names.get(channel_id)
+            ]
+
+            try:
+                start = time.perf_counter()
+                count = await db.insert_follows(rows)
+                elapsed = (time.perf_counter() - start) * 1000
+            except exc.OperationalError:
+                await status.edit(embed=create_embed(
+                    ctx, message_type='Error', message='Cannot save channel follows to database'))
+            else:
+                follows_added(user_id, rows)
+                self.bot.loop.create_task(eventsub.channels_added([row['channel_id'] for row in rows]))
+                await status.edit(embed=create_embed(
+                    ctx,
+                    message_type='Success',
+                    message=f'Imported {count} channel follows to database in {elapsed:.0f} ms'
+                ))
 
     @follows.command()
     async def add(self, ctx, *channels: str):
@@ -98,35 +123,47 @@ class Follow:
         """
         user_id = ctx.message.author.id
         username = ctx.message.author.name
+        # Twitch logins are lowercase, so followed channels are saved the way remove looks them up
+        channels = list(dict.fromkeys(channel.lower() for channel in channels))
 
-        for channel in channels:
-            follows = check_follows_exist(user_id, channel)
-            if follows:
-                await embed_message(
-                    ctx,
-                    message_type='Error',
-                    message=f'Channel {channel} is already saved in database'
-                )
-            else:
-                channel_id = await retrieve_twitch_channel_id(ctx, channel)
-                if channel_id:
-                    try:
-                        new_follow = Follows(
-                            user_id=user_id, username=username, channel=channel, channel_id=channel_id)
-                        session.add(new_follow)
-                        session.commit()
-                        await embed_message(
-                            ctx,
-                            message_type='Success',
-                            message=f'Channel {channel} has been saved to database'
-                        )
-                    except exc.OperationalError:
-                        session.rollback()
-                        await embed_message(
-                            ctx,
-                            message_type='Error',
-                            message=f'Cannot save channel {channel} to database'
-                        )
+        # One batched users lookup resolves every channel, unknown ones are reported in the summary
+        channel_ids = await retrieve_twitch_channel_ids(ctx, channels)
+        unknown = [channel for channel in channels if not channel_ids.get(channel)]
+        rows = [
+            {'user_id': user_id, 'username': username, 'channel': channel, 'channel_id': int(channel_ids[channel])}
+            for channel in channels if channel_ids.get(channel)
+        ]
+
+        if not rows:
+            return await embed_message(
+                ctx,
+                message_type='Error',
+                message=f'Channels {", ".join(unknown)} do not exist' if unknown else 'No channels given to add'
+            )
+
+        try:
+            start = time.perf_counter()
+            count = await db.insert_follows(rows)
+            elapsed = (time.perf_counter() - start) * 1000
+        except exc.OperationalError:
+            await embed_message(
+                ctx,
+                message_type='Error',
+                message='Cannot save channel follows to database'
+            )
+        else:
+            follows_added(user_id, rows)
+            self.bot.loop.create_task(eventsub.channels_added([row['channel_id'] for row in rows]))
+            message = f'Saved {count} channel follows to database in {elapsed:.0f} ms'
+            if count < len(rows):
+                message += f' ({len(rows) - count} already saved)'
+            if unknown:
+                message += f' \nChannels that do not exist: {", ".join(unknown)}'
+            await embed_message(
+                ctx,
+                message_type='Success' if count else 'Error',
+                message=message
+            )
 
     @follows.command()
     async def live(self, ctx):
@@ -134,37 +171,19 @@ class Follow:
         List viewer count for live followed channels
         """
         user_id = ctx.message.author.id
-        follows = check_follows_exist(user_id, channel=None)
+        follows = await check_follows_exist(user_id, channel=None)
 
         if follows:
-            channels = []
-            count = 0
-            for follow in follows:
-                data = await twitch_api_call(
-                    ctx,
-                    endpoint='streams?user_id=',
-                    channel=follow.channel_id,
-                    params='&type=live'
-                )
-                try:
-                    viewers = locale.format(
-                        '%d', data['data'][0]['viewer_count'], grouping=True)
-                    count += 1
-                    channels.append(f'{count}. {follow.channel}')
-                    channels.append(viewers)
-                except IndexError:
-                    pass
-            if count == 0:
+            streams = await poller.get_streams(ctx, [follow.channel_id for follow in follows])
+            live = [
+                (follow, streams[str(follow.channel_id)]) for follow in follows if str(follow.channel_id) in streams
+            ]
+            rows = (
+                (f'{count}. {follow.channel}', locale.format('%d', stream.viewer_count, grouping=True))
+                for count, (follow, stream) in enumerate(live, start=1)
+            )
+            if await send_pages(ctx, ['Live Channels', 'Viewers'], rows) is None:
                 await embed_message(ctx, message_type='Error', message='No channels are currently live')
-            else:
-                embed = discord.Embed()
-                embed.add_field(name='Live Channels',
-                                value=' \n'.join(channels[0::2]))
-                embed.add_field(
-                    name='Viewers', value=' \n'.join(channels[1::2]))
-                embed.set_footer(text=f'Requested by {ctx.message.author}')
-                embed.colour = 0x738bd7
-                await ctx.send(embed=embed)
         else:
             await embed_message(ctx, message_type='Error', message='No channels saved in database')
 
@@ -174,38 +193,19 @@ class Follow:
         List uptime for live followed channels
         """
         user_id = ctx.message.author.id
-        follows = check_follows_exist(user_id, channel=None)
+        follows = await check_follows_exist(user_id, channel=None)
 
         if follows:
-            channels = []
-            count = 0
-            for follow in follows:
-                data = await twitch_api_call(
-                    ctx,
-                    endpoint='streams?user_id=',
-                    channel=follow.channel_id,
-                    params='&type=live'
-                )
-                try:
-                    uptime = twitch_convert_timestamp(
-                        data['data'][0]['started_at'])
-                    uptime = twitch_channel_uptime(uptime)
-                    count += 1
-                    channels.append(f'{count}. {follow.channel}')
-                    channels.append(str(uptime))
-                except IndexError:
-                    pass
-            if count == 0:
+            streams = await poller.get_streams(ctx, [follow.channel_id for follow in follows])
+            live = [
+                (follow, streams[str(follow.channel_id)]) for follow in follows if str(follow.channel_id) in streams
+            ]
+            rows = (
+                (f'{count}. {follow.channel}', twitch_channel_uptime(twitch_convert_timestamp(stream.started_at)))
+                for count, (follow, stream) in enumerate(live, start=1)
+            )
+            if await send_pages(ctx, ['Live Channels', 'Uptime'], rows) is None:
                 await embed_message(ctx, message_type='Error', message='No channels are currently live')
-            else:
-                embed = discord.Embed()
-                embed.add_field(name='Live Channels',
-                                value=' \n'.join(channels[0::2]))
-                embed.add_field(
-                    name='Uptime', value=' \n'.join(channels[1::2]))
-                embed.set_footer(text=f'Requested by {ctx.message.author}')
-                embed.colour = 0x738bd7
-                await ctx.send(embed=embed)
         else:
             await embed_message(ctx, message_type='Error', message='No channels saved in database')
 
@@ -215,37 +215,47 @@ class Follow:
         List game title for live followed channels
         """
         user_id = ctx.message.author.id
-        follows = check_follows_exist(user_id, channel=None)
+        follows = await check_follows_exist(user_id, channel=None)
 
         if follows:
-            channels = []
-            count = 0
-            for follow in follows:
-                data = await twitch_api_call(
-                    ctx,
-                    endpoint='streams?user_id=',
-                    channel=follow.channel_id,
-                    params='&type=live'
-                )
-                try:
-                    game = data['data'][0]['game_id']
-                    game = await retrieve_twitch_game(ctx, game)
-                    game = textwrap.shorten(game, width=60, placeholder="...")
-                    count += 1
-                    channels.append(f'{count}. {follow.channel}')
-                    channels.append(game)
-                except IndexError:
-                    pass
-            if count == 0:
+            streams = await poller.get_streams(ctx, [follow.channel_id for follow in follows])
+            live = [follow for follow in follows if str(follow.channel_id) in streams]
+
+            async def rows():
+                # Games are only looked up for pages that get viewed, one batched request per page
+                for start in range(0, len(live), self.PAGE_SIZE):
+                    page = live[start:start + self.PAGE_SIZE]
+                    games, _ = await gather_lookups(ctx, [
+                        retrieve_twitch_game(ctx, streams[str(follow.channel_id)].game_id) for follow in page
+                    ], 'Cannot retrieve game titles')
+                    for count, (follow, game) in enumerate(zip(page, games), start=start + 1):
+                        yield f'{count}. {follow.channel}', textwrap.shorten(game or '', width=60, placeholder="...")
+
+            if await send_pages(ctx, ['Live Channels', 'Game'], rows(), per_page=self.PAGE_SIZE) is None:
                 await embed_message(ctx, message_type='Error', message='No channels are currently live')
-            else:
-                embed = discord.Embed()
-                embed.add_field(name='Live Channels',
-                                value=' \n'.join(channels[0::2]))
-                embed.add_field(name='Game', value=' \n'.join(channels[1::2]))
-                embed.set_footer(text=f'Requested by {ctx.message.author}')
-                embed.colour = 0x738bd7
-                await ctx.send(embed=embed)
+        else:
+            await embed_message(ctx, message_type='Error', message='No channels saved in database')
+
+    @follows.command()
+    async def popular(self, ctx, count: int = 10):
+        """
+        List the most followed channels
+        """
+        if not follower_index.ready:
+            return await embed_message(ctx, message_type='Info', message='Follower index is still loading')
+
+        popular = follower_index.popular(max(1, min(count, 100)))
+        if popular:
+            streams = await poller.get_streams(ctx, [channel_id for channel_id, channel, followers in popular])
+            rows = (
+                (
+                    f'{rank}. {channel}',
+                    locale.format('%d', followers, grouping=True),
+                    'Live' if str(channel_id) in streams else 'Offline'
+                )
+                for rank, (channel_id, channel, followers) in enumerate(popular, start=1)
+            )
+            await send_pages(ctx, ['Popular Channels', 'Follows', 'Status'], rows)
         else:
             await embed_message(ctx, message_type='Error', message='No channels saved in database')
 
@@ -255,31 +265,36 @@ class Follow:
         Remove channel follows
         """
         user_id = ctx.message.author.id
+        channels = {channel.lower() for channel in channels}
+
+        if not channels:
+            return await embed_message(ctx, message_type='Error', message='No channels given to remove')
 
-        for channel in channels:
-            follows = check_follows_exist(user_id, channel)
-            if follows:
-                try:
-                    for follow in follows:
-                        session.delete(follow)
-                        session.commit()
-                        await embed_message(
-                            ctx,
-                            message_type='Success',
-                            message=f'Channel {channel} has been removed from database'
-                        )
-                except exc.OperationalError:
-                    session.rollback()
-                    await embed_message(
-                        ctx,
-                        message_type='Error',
-                        message=f'Cannot remove channel {channel} in database'
-                    )
+        try:
+            start = time.perf_counter()
+            removed = await db.delete_follows(user_id, sorted(channels))
+            elapsed = (time.perf_counter() - start) * 1000
+        except exc.OperationalError:
+            await embed_message(
+                ctx,
+                message_type='Error',
+                message='Cannot remove channel follows in database'
+            )
+        else:
+            missing = channels - {channel for channel, channel_id in removed}
+            if removed:
+                follows_removed(user_id, removed)
+                self.bot.loop.create_task(
+                    eventsub.channels_removed([channel_id for channel, channel_id in removed]))
+                message = f'Removed {len(removed)} channel follows from database in {elapsed:.0f} ms'
+                if missing:
+                    message += f' \nNot saved in database: {", ".join(sorted(missing))}'
+                await embed_message(ctx, message_type='Success', message=message)
             else:
                 await embed_message(
                     ctx,
                     message_type='Error',
-                    message=f'Channel {channel} is not saved in database'
+                    message=f'Channels {", ".join(sorted(missing))} are not saved in database'
                 )
 
     @follows.command(aliases=['removeall', 'deleteall'])
@@ -289,31 +304,32 @@ class Follow:
         """
         user_id = ctx.message.author.id
 
-        follows = check_follows_exist(user_id, channel=None)
-
-        if follows:
-            try:
-                for follow in follows:
-                    session.delete(follow)
-                    session.commit()
+        try:
+            start = time.perf_counter()
+            removed = await db.delete_follows(user_id)
+            elapsed = (time.perf_counter() - start) * 1000
+        except exc.OperationalError:
+            await embed_message(
+                ctx,
+                message_type='Error',
+                message='Cannot remove channel follows in database'
+            )
+        else:
+            if removed:
+                follows_removed(user_id, removed)
+                self.bot.loop.create_task(
+                    eventsub.channels_removed([channel_id for channel, channel_id in removed]))
                 await embed_message(
                     ctx,
                     message_type='Success',
-                    message=f'Removed {len(follows)} channel follows from database'
+                    message=f'Removed {len(removed)} channel follows from database in {elapsed:.0f} ms'
                 )
-            except exc.OperationalError:
-                session.rollback()
+            else:
                 await embed_message(
                     ctx,
                     message_type='Error',
-                    message='Cannot remove channel follows in database'
+                    message='No channels saved in database'
                 )
-        else:
-            return await embed_message(
-                ctx,
-                message_type='Error',
-                message='No channels saved in database'
-            )
 
 
 def setup(bot):
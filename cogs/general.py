@@ -5,7 +5,7 @@ from discord.ext import commands
 from pytz import timezone
 
 from bot import load_config
-from core.models import Follows, session
+from core import db
 
 
 class General:
@@ -50,10 +50,7 @@ class General:
             owner = await self.bot.get_user_info(self.config['bot']['owner'])
             timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-            query = session.query(Follows)
-            users = query.distinct(Follows.user_id).group_by(
-                Follows.user_id).count()
-            follows = query.count()
+            users, follows = await db.count_follows()
 
             embed = discord.Embed()
             embed.add_field(name='Host Local Time (UTC)', value=timestamp)
@@ -1,3 +1,4 @@
+import asyncio
 import locale
 import textwrap
 
@@ -5,8 +6,12 @@ import discord
 from discord.ext import commands
 
 from bot import load_config
-from core.utils import twitch_api_call, twitch_convert_timestamp, twitch_channel_uptime, retrieve_twitch_channel_id, \
-    retrieve_twitch_game, retrieve_twitch_channel_name, embed_message
+from core.poller import poller
+from core.render import send_pages
+from core.scheduler import scheduler
+from core.utils import twitch_api_call, twitch_api_cached, twitch_convert_timestamp, twitch_channel_uptime, \
+    retrieve_twitch_channel_ids, retrieve_twitch_game, retrieve_twitch_channel_name, retrieve_twitch_users, \
+    embed_message, gather_lookups
 
 
 class Twitch:
@@ -14,9 +19,33 @@ class Twitch:
     Bot commands to retrieve twitch.tv API data
     """
 
+    # More channels than this are answered with one combined embed
+    COMBINED_THRESHOLD = 3
+    FOLLOWS_CONCURRENCY = 5
+
     def __init__(self, bot):
         self.bot = bot
         self.config = load_config()
+        self.rendered = {}
+
+    async def __before_invoke(self, ctx):
+        # Each named channel costs about one users, streams or follows request
+        if ctx.command.name in ('stream', 'info'):
+            await scheduler.acquire(ctx, cost=len(ctx.args) - 2)
+
+    async def __after_invoke(self, ctx):
+        scheduler.release(ctx)
+
+    def get_rendered(self, key, data):
+        # Rows are reused for as long as the cached response they were built from
+        rendered = self.rendered.get(key)
+        if rendered is not None and rendered[0] is data:
+            return rendered[1]
+        return None
+
+    def set_rendered(self, key, data, rows):
+        self.rendered[key] = (data, rows)
+        return rows
 
     @staticmethod
     async def embed_twitch_message(ctx, description):
@@ -25,114 +54,171 @@ class Twitch:
         embed.colour = 0x9b59b6
         return await ctx.send(embed=embed)
 
+    async def send_combined(self, ctx, rows):
+        # Discord allows at most 25 fields per embed
+        for i in range(0, len(rows), 25):
+            embed = discord.Embed()
+            for name, value in rows[i:i + 25]:
+                embed.add_field(name=name, value=value, inline=False)
+            embed.set_footer(text=f'Requested by {ctx.message.author}')
+            embed.colour = 0x9b59b6
+            await ctx.send(embed=embed)
+
     @commands.command(aliases=['live', 'uptime', 'game'])
     async def stream(self, ctx, *channels: str):
         """
         Return stream information for live channel
         """
+        channels = [channel.lower() for channel in channels]
+        # One batched users lookup and one batched streams lookup for every channel
+        channel_ids = await retrieve_twitch_channel_ids(ctx, channels)
+        streams = await poller.get_streams(ctx, [channel_id for channel_id in channel_ids.values() if channel_id])
+        live = [streams[channel_ids[channel]] for channel in channels if channel_ids[channel] in streams]
+        games, _ = await gather_lookups(
+            ctx, [retrieve_twitch_game(ctx, stream.game_id) for stream in live], 'Cannot retrieve game titles')
+        games = iter(games)
+
+        combined = len(channels) > self.COMBINED_THRESHOLD
+        rows = []
         for channel in channels:
-            channel_id = await retrieve_twitch_channel_id(ctx, channel)
-            if channel_id:
-                data = await twitch_api_call(
-                    ctx,
-                    endpoint='streams?user_id=',
-                    channel=channel_id,
-                    params='&type=live'
-                )
-                try:
-                    game = data['data'][0]['game_id']
-                    game = await retrieve_twitch_game(ctx, game)
-                    game = textwrap.shorten(game, width=60, placeholder="...")
-                    viewers = locale.format(
-                        '%d', data['data'][0]['viewer_count'], grouping=True)
-                    uptime = twitch_convert_timestamp(
-                        data['data'][0]['started_at'])
-                    uptime = twitch_channel_uptime(uptime)
-                    embed = discord.Embed()
-                    embed.add_field(
-                        name='Channel', value=channel.lower(), inline=False)
-                    embed.add_field(
-                        name='Title', value=data['data'][0]['title'], inline=False)
-                    embed.add_field(name='Game', value=game, inline=False)
-                    embed.add_field(
-                        name='Viewers', value=viewers, inline=False)
-                    embed.add_field(name='Uptime', value=uptime, inline=False)
-                    embed.add_field(
-                        name='URL', value=f'https://www.twitch.tv/{channel.lower()}', inline=False)
-                    embed.set_footer(text=f'Requested by {ctx.message.author}')
-                    embed.colour = 0x9b59b6
-                    await ctx.send(embed=embed)
-                except IndexError:
+            channel_id = channel_ids[channel]
+            stream = streams.get(channel_id)
+            if channel_id is None:
+                if combined:
+                    rows.append((channel, 'Channel does not exist'))
+                else:
+                    await embed_message(ctx, message_type='Error', message=f'Channel {channel} does not exist')
+                continue
+            elif stream is None:
+                if combined:
+                    rows.append((channel, 'Offline'))
+                else:
                     await embed_message(ctx, message_type='Info', message=f'Channel {channel} is offline')
+                continue
+
+            game = textwrap.shorten(next(games) or '', width=60, placeholder="...")
+            viewers = locale.format(
+                '%d', stream.viewer_count, grouping=True)
+            uptime = twitch_convert_timestamp(stream.started_at)
+            uptime = twitch_channel_uptime(uptime)
+
+            if combined:
+                rows.append((channel, f'{game} \n{viewers} viewers for {uptime}'))
+            else:
+                embed = discord.Embed()
+                embed.add_field(
+                    name='Channel', value=channel, inline=False)
+                embed.add_field(
+                    name='Title', value=stream.title, inline=False)
+                embed.add_field(name='Game', value=game, inline=False)
+                embed.add_field(
+                    name='Viewers', value=viewers, inline=False)
+                embed.add_field(name='Uptime', value=uptime, inline=False)
+                embed.add_field(
+                    name='URL', value=f'https://www.twitch.tv/{channel}', inline=False)
+                embed.set_footer(text=f'Requested by {ctx.message.author}')
+                embed.colour = 0x9b59b6
+                await ctx.send(embed=embed)
+
+        if combined:
+            await self.send_combined(ctx, rows)
 
     @commands.command()
     async def info(self, ctx, *channels: str):
         """
         Return basic channel information
         """
+        channels = [channel.lower() for channel in channels]
+        users = await retrieve_twitch_users(ctx, channels)
+        semaphore = asyncio.Semaphore(self.FOLLOWS_CONCURRENCY)
+
+        async def follower_total(user):
+            async with semaphore:
+                data = await twitch_api_call(ctx, endpoint='users/follows?to_id=', channel=user['id'], params='')
+                return data['total'] if data else 0
+
+        found = [channel for channel in channels if channel in users]
+        totals = dict(zip(found, await asyncio.gather(*[follower_total(users[channel]) for channel in found])))
+
+        combined = len(channels) > self.COMBINED_THRESHOLD
+        rows = []
         for channel in channels:
-            channel_id = await retrieve_twitch_channel_id(ctx, channel)
-            if channel_id:
-                data = await twitch_api_call(ctx, endpoint='users?id=', channel=channel_id, params='')
-                views = locale.format(
-                    '%d', data['data'][0]['view_count'], grouping=True)
-                follows = await twitch_api_call(ctx, endpoint='users/follows?to_id=', channel=channel_id, params='')
-                follows = locale.format('%d', follows['total'], grouping=True)
+            if channel not in users:
+                if combined:
+                    rows.append((channel, 'Channel does not exist'))
+                else:
+                    await embed_message(ctx, message_type='Error', message=f'Channel {channel} does not exist')
+                continue
+
+            user = users[channel]
+            views = locale.format(
+                '%d', user['view_count'], grouping=True)
+            follows = locale.format('%d', totals[channel], grouping=True)
+
+            if combined:
+                rows.append((channel, f'{user["broadcaster_type"] or "none"} \n{views} views, {follows} follows'))
+            else:
                 embed = discord.Embed()
                 embed.add_field(
-                    name='Channel', value=channel.lower(), inline=False)
+                    name='Channel', value=channel, inline=False)
                 embed.add_field(
-                    name='Broadcaster', value=data['data'][0]['broadcaster_type'], inline=False)
+                    name='Broadcaster', value=user['broadcaster_type'], inline=False)
                 embed.add_field(name='Views', value=views, inline=False)
                 embed.add_field(name='Follows', value=follows, inline=False)
                 embed.add_field(
-                    name='Description', value=data['data'][0]['description'], inline=False)
+                    name='Description', value=user['description'], inline=False)
                 embed.add_field(
-                    name='URL', value=f'https://www.twitch.tv/{channel.lower()}', inline=False)
+                    name='URL', value=f'https://www.twitch.tv/{channel}', inline=False)
                 embed.set_footer(text=f'Requested by {ctx.message.author}')
                 embed.colour = 0x9b59b6
                 await ctx.send(embed=embed)
 
+        if combined:
+            await self.send_combined(ctx, rows)
+
     @commands.group()
     async def top(self, ctx):
         """
         List top game titles by viewer count
         """
         if ctx.invoked_subcommand is None:
-            data = await twitch_api_call(ctx, endpoint='games/top', channel='', params='?first=10')
-            games = []
+            data = await twitch_api_cached(ctx, endpoint='games/top', channel='', params='?first=10')
+            if data is None:
+                return
 
-            for count, game in enumerate(data['data'], start=1):
-                game = game['name']
-                game = textwrap.shorten(game, width=60, placeholder="...")
-                games.append(f'{count}. {game}')
-            embed = discord.Embed()
-            embed.add_field(name='Game', value=' \n'.join(games[0::1]))
-            embed.set_footer(text=f'Requested by {ctx.message.author}')
-            embed.colour = 0x9b59b6
-            await ctx.send(embed=embed)
+            rows = self.get_rendered('top', data)
+            if rows is None:
+                rows = self.set_rendered('top', data, [
+                    (f'{count}. {textwrap.shorten(game["name"], width=60, placeholder="...")}',)
+                    for count, game in enumerate(data['data'], start=1)
+                ])
+            if await send_pages(ctx, ['Game'], rows, colour=0x9b59b6) is None:
+                await embed_message(ctx, message_type='Error', message='No games are currently live')
 
     @top.command()
     async def channels(self, ctx):
         """
         List top channels by viewer count
         """
-        data = await twitch_api_call(ctx, endpoint='streams', channel='', params='?first=10&type=live')
-        channels = []
+        data = await twitch_api_cached(ctx, endpoint='streams', channel='', params='?first=10&type=live')
+        if data is None:
+            return
 
-        for count, channel in enumerate(data['data'], start=1):
-            channel_id = channel['user_id']
-            channel_id = await retrieve_twitch_channel_name(ctx, channel_id)
-            viewers = locale.format(
-                '%d', channel['viewer_count'], grouping=True)
-            channels.append(f'{count}. {channel_id}')
-            channels.append(viewers)
-        embed = discord.Embed()
-        embed.add_field(name='Channel', value=' \n'.join(channels[0::2]))
-        embed.add_field(name='Viewers', value=' \n'.join(channels[1::2]))
-        embed.set_footer(text=f'Requested by {ctx.message.author}')
-        embed.colour = 0x9b59b6
-        await ctx.send(embed=embed)
+        rows = self.get_rendered('channels', data)
+        if rows is None:
+            # Name lookups issued together are batched into one users request
+            names, failed = await gather_lookups(ctx, [
+                retrieve_twitch_channel_name(ctx, channel['user_id']) for channel in data['data']
+            ], 'Cannot retrieve channel names')
+            rows = [
+                (f'{count}. {name or "unknown"}', locale.format('%d', channel['viewer_count'], grouping=True))
+                for count, (channel, name) in enumerate(zip(data['data'], names), start=1)
+            ]
+            # Unresolved names are retried on the next request instead of being reused
+            if not failed and None not in names:
+                self.set_rendered('channels', data, rows)
+        if await send_pages(ctx, ['Channel', 'Viewers'], rows, colour=0x9b59b6) is None:
+            await embed_message(ctx, message_type='Error', message='No channels are currently live')
 
 
 def setup(bot):
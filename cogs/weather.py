@@ -1,11 +1,12 @@
-import os
+import io
 
-import aiohttp
 import discord
 from discord.ext import commands
 
 from bot import load_config
+from core.render import send_pages
 from core.utils import embed_message
+from core.weather import weather
 
 
 class Weather:
@@ -17,27 +18,14 @@ class Weather:
         self.bot = bot
         self.config = load_config()
 
-    async def weather_api_call(self, ctx, endpoint, zip_code):
-        async with aiohttp.ClientSession() as session:
-            api_key = self.config['wunderground']['key']
-            url = f'http://api.wunderground.com/api/{api_key}/{endpoint}/q/{zip_code}.json'
-            async with session.get(url, timeout=60) as resp:
-                data = await resp.json()
-
-                if resp.status == 200:
-                    return data
-                elif aiohttp.ServerTimeoutError:
-                    await embed_message(ctx, message_type='Error', message='Connection Timeout')
-                else:
-                    await embed_message(ctx, message_type='Error', message='Unexpected Error')
-                return None
-
     @commands.command()
     async def wx(self, ctx, zip_code: int):
         """
         Return current weather conditions
         """
-        data = await self.weather_api_call(ctx, endpoint='conditions', zip_code=zip_code)
+        data = await weather.get(ctx, 'conditions', zip_code)
+        if data is None:
+            return
 
         try:
             embed = discord.Embed()
@@ -64,7 +52,9 @@ class Weather:
         """
         Return three day weather forecast
         """
-        data = await self.weather_api_call(ctx, endpoint='forecast', zip_code=zip_code)
+        data = await weather.get(ctx, 'forecast', zip_code)
+        if data is None:
+            return
 
         try:
             embed = discord.Embed()
@@ -110,28 +100,16 @@ class Weather:
         Display static radar image
         """
         try:
-            data = await self.weather_api_call(ctx, endpoint='conditions', zip_code=zip_code)
-            if data['current_observation']['display_location']['zip'] == str(zip_code):
-                async with aiohttp.ClientSession() as session:
-                    api_key = self.config['wunderground']['key']
-                    url = f'http://api.wunderground.com/api/' \
-                          f'{api_key}/radar/q/{zip_code}.png?newmaps=1&smooth=1&noclutter=1'
-                    async with session.get(url, timeout=60) as resp:
-                        if resp.status == 200:
-                            radar_image = f'{zip_code}_radar.png'
-                            with open(radar_image, 'wb') as f:
-                                while True:
-                                    chunk = await resp.content.read()
-                                    if not chunk:
-                                        break
-                                    f.write(chunk)
-                                    await ctx.send(file=discord.File(radar_image))
-                            os.remove(radar_image)
-                        elif aiohttp.ServerTimeoutError:
-                            await embed_message(ctx, message_type='Error', message='Connection Timeout')
-                        else:
-                            await embed_message(ctx, message_type='Error', message='Unexpected Error')
-                        return None
+            # Validated zip codes are cached, so repeat requests go straight to the image.
+            # Unknown zip codes have an empty location and fail the lookup below
+            location = await weather.location(ctx, zip_code)
+            if location is None:
+                return
+            if location['zip'] == str(zip_code):
+                image = await weather.radar(ctx, zip_code)
+                if image is not None:
+                    # Every upload reads from its own buffer over the shared cached bytes
+                    await ctx.send(file=discord.File(io.BytesIO(image), filename=f'{zip_code}_radar.png'))
         except KeyError:
             await embed_message(ctx, message_type='Error', message='Zip code is invalid')
 
@@ -140,26 +118,17 @@ class Weather:
         """
         Return current weather alerts
         """
-        data = await self.weather_api_call(ctx, endpoint='alerts', zip_code=zip_code)
+        data = await weather.get(ctx, 'alerts', zip_code)
+        if data is None:
+            return
 
         try:
-            alerts = []
-            count = 0
-            for alert in data['alerts']:
-                count += 1
-                alert_description = alert['description']
-                alerts.append(f'{count}. {alert_description}')
-            if count == 0:
-                await embed_message(ctx, message_type='Info', message='No active weather alerts')
-            else:
-                embed = discord.Embed()
-                embed.add_field(name='Active Weather Alerts',
-                                value=' \n'.join(alerts))
-                embed.set_footer(text=f'Requested by {ctx.message.author}')
-                embed.colour = 0x738bd7
-                await ctx.send(embed=embed)
+            rows = [(f'{count}. {alert["description"]}',) for count, alert in enumerate(data['alerts'], start=1)]
         except KeyError:
-            await embed_message(ctx, message_type='Error', message='Zip code is invalid')
+            return await embed_message(ctx, message_type='Error', message='Zip code is invalid')
+
+        if await send_pages(ctx, ['Active Weather Alerts'], rows) is None:
+            await embed_message(ctx, message_type='Info', message='No active weather alerts')
 
 
 def setup(bot):
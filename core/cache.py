@@ -0,0 +1,357 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+MISSING = object()
+log = logging.getLogger('discord')
+
+_connections = {}
+_persistent = []
+# A single thread owns every SQLite connection, so cache I/O never runs on the event loop
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cache')
+
+
+class CacheBackend:
+    """
+    Interface shared by the key/value caches used for Twitch lookups
+    """
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def pop(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        raise NotImplementedError
+
+    async def ready(self):
+        # Backends loading their contents in the background finish that first
+        return
+
+
+class TTLCache(CacheBackend):
+    """
+    Bounded LRU cache with a per-entry time-to-live
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        try:
+            value, expires = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return MISSING
+
+        if expires < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return MISSING
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        self._data[key] = (value, time.monotonic() + ttl)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups * 100 if lookups else 0.0
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': hit_rate
+        }
+
+
+def connect(path):
+    connection = _connections.get(path)
+    if connection is None:
+        # Only used from the cache thread; transactions are started explicitly
+        connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA busy_timeout=1000')
+        columns = [row[1] for row in connection.execute('PRAGMA table_info(cache)')]
+        if columns and 'written' not in columns:
+            # Cached entries are disposable, so an older layout is simply replaced
+            connection.execute('DROP TABLE cache')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS cache ('
+            'namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires REAL NOT NULL, '
+            'written REAL NOT NULL, PRIMARY KEY (namespace, key))'
+        )
+        _connections[path] = connection
+    return connection
+
+
+class SQLiteCache(CacheBackend):
+    """
+    Persistent cache in a SQLite database shared by restarts and worker processes
+
+    Lookups only ever touch memory. The database is read and written on the cache
+    thread: a warm-up on start, periodic syncs of entries written by other workers,
+    and write-behind flushes that batch pending writes into one transaction.
+    Deletes reach other workers' memory only once their copies expire.
+    """
+
+    FLUSH_INTERVAL = 1
+    SYNC_INTERVAL = 15
+    PRUNE_EVERY = 60
+
+    def __init__(self, path, namespace, maxsize=1024, ttl=3600):
+        self.path = path
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._pending = {}
+        self._clear = False
+        self._synced = 0.0
+        self._ready = None
+        self._task = None
+        _persistent.append(self)
+
+    def __len__(self):
+        return len(self._local)
+
+    def start(self, loop):
+        if self._task is None:
+            self._ready = loop.create_future()
+            self._task = loop.create_task(self.run())
+
+    async def ready(self):
+        if self._ready is not None:
+            await asyncio.shield(self._ready)
+
+    async def run(self):
+        try:
+            await self.sync()
+        except Exception:
+            log.exception(f'Failed to load cache {self.namespace}')
+        finally:
+            self._ready.set_result(None)
+
+        flushes = 0
+        while True:
+            await asyncio.sleep(self.FLUSH_INTERVAL)
+            flushes += 1
+            try:
+                await self.flush(prune=flushes % self.PRUNE_EVERY == 0)
+                if time.time() - self._synced >= self.SYNC_INTERVAL:
+                    await self.sync()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception(f'Failed to sync cache {self.namespace}')
+
+    def get(self, key):
+        return self._local.get(str(key))
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        key = str(key)
+        self._local.set(key, value, ttl=ttl)
+        # Serialized on the cache thread when the next flush runs
+        self._pending[key] = (value, time.time() + ttl)
+
+    def pop(self, key):
+        key = str(key)
+        self._local.pop(key)
+        self._pending[key] = None
+
+    def clear(self):
+        self._local.clear()
+        self._pending = {}
+        self._clear = True
+
+    async def flush(self, prune=False):
+        if not self._pending and not self._clear and not prune:
+            return
+        pending, clear = self._pending, self._clear
+        self._pending, self._clear = {}, False
+        await asyncio.get_event_loop().run_in_executor(executor, self._write, pending, clear, prune)
+
+    def _write(self, pending, clear, prune):
+        connection = connect(self.path)
+        now = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            if clear:
+                connection.execute('DELETE FROM cache WHERE namespace = ?', (self.namespace,))
+            connection.executemany(
+                'INSERT OR REPLACE INTO cache (namespace, key, value, expires, written) VALUES (?, ?, ?, ?, ?)',
+                [
+                    (self.namespace, key, json.dumps(entry[0]), entry[1], now)
+                    for key, entry in pending.items() if entry is not None
+                ]
+            )
+            connection.executemany(
+                'DELETE FROM cache WHERE namespace = ? AND key = ?',
+                [(self.namespace, key) for key, entry in pending.items() if entry is None]
+            )
+            if prune:
+                connection.execute('DELETE FROM cache WHERE namespace = ? AND expires < ?', (self.namespace, now))
+                # Entries closest to expiry are dropped first once the namespace is over its size
+                connection.execute(
+                    'DELETE FROM cache WHERE namespace = ? AND key IN ('
+                    'SELECT key FROM cache WHERE namespace = ? ORDER BY expires DESC LIMIT -1 OFFSET ?)',
+                    (self.namespace, self.namespace, self.maxsize)
+                )
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    async def sync(self):
+        # Small overlap so entries written during the previous read are not missed
+        since = self._synced - 1
+        self._synced = time.time()
+        rows = await asyncio.get_event_loop().run_in_executor(executor, self._read, since)
+
+        now = time.time()
+        for key, value, expires in rows:
+            # Local writes not flushed yet are newer than anything in the database
+            if key not in self._pending and expires > now:
+                self._local.set(key, value, ttl=expires - now)
+
+    def _read(self, since):
+        rows = connect(self.path).execute(
+            'SELECT key, value, expires FROM cache WHERE namespace = ? AND written >= ? AND expires > ?',
+            (self.namespace, since, time.time())
+        ).fetchall()
+        return [(key, json.loads(value), expires) for key, value, expires in rows]
+
+    def stats(self):
+        stats = self._local.stats()
+        stats['maxsize'] = self.maxsize
+        return stats
+
+
+def start_persistent_caches(loop):
+    for cache in _persistent:
+        cache.start(loop)
+
+
+def create_cache(namespace, maxsize=1024, ttl=3600, backend='memory', path='cache.db'):
+    if backend == 'sqlite':
+        return SQLiteCache(path, namespace, maxsize=maxsize, ttl=ttl)
+    return TTLCache(maxsize=maxsize, ttl=ttl)
+
+
+class ResponseCache:
+    """
+    Shared response cache that serves stale entries while a single refresh runs
+    """
+
+    def __init__(self, ttl=60, stale_ttl=600):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._data = {}
+        self._refreshing = {}
+
+    def __len__(self):
+        return len(self._data)
+
+    async def get(self, ctx, key, fetch):
+        now = time.monotonic()
+        entry = self._data.get(key)
+
+        if entry is not None:
+            value, fresh_until, stale_until = entry
+            if now < fresh_until:
+                self.hits += 1
+                return value
+            if now < stale_until:
+                # Background refreshes have no context to report errors to
+                self.stale_hits += 1
+                self._start_refresh(None, key, fetch)
+                return value
+
+        self.misses += 1
+        task, owner = self._start_refresh(ctx, key, fetch)
+        value = await asyncio.shield(task)
+        # fetch reports errors to the context that started the refresh, so any other waiter is told here
+        if value is MISSING or (value is None and owner is not ctx):
+            raise LookupError(f'Cached response {key} could not be refreshed')
+        return value
+
+    def _start_refresh(self, ctx, key, fetch):
+        refresh = self._refreshing.get(key)
+        if refresh is None:
+            refresh = (asyncio.ensure_future(self._refresh(ctx, key, fetch)), ctx)
+            self._refreshing[key] = refresh
+        return refresh
+
+    async def _refresh(self, ctx, key, fetch):
+        try:
+            value = await fetch(ctx)
+        except Exception:
+            log.exception(f'Failed to refresh cached response {key}')
+            return MISSING
+        finally:
+            self._refreshing.pop(key, None)
+
+        if value is not None:
+            now = time.monotonic()
+            self._data[key] = (value, now + self.ttl, now + self.ttl + self.stale_ttl)
+        return value
+
+    def clear(self):
+        self._data.clear()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.stale_hits + self.misses
+        hit_rate = (self.hits + self.stale_hits) / lookups * 100 if lookups else 0.0
+        return {
+            'size': len(self._data),
+            'maxsize': len(self._data),
+            'hits': self.hits + self.stale_hits,
+            'misses': self.misses,
+            'hit_rate': hit_rate
+        }
@@ -0,0 +1,91 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import asc, distinct, func
+
+from . import metrics
+from .models import Session, Follows
+
+executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='db')
+db_latency = metrics.Histogram('db_operation_duration_seconds', 'Database operation latency', ['operation'])
+
+
+def _call(operation, args, kwargs):
+    session = Session()
+    try:
+        with db_latency.time(operation.__name__):
+            result = operation(session, *args, **kwargs)
+            session.commit()
+        return result
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def db_operation(operation):
+    """
+    Run a blocking session operation on the database thread pool
+    """
+
+    @functools.wraps(operation)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(executor, _call, operation, args, kwargs)
+
+    return wrapper
+
+
+@db_operation
+def get_follow_records(session, user_id):
+    # Plain column tuples, without materializing ORM instances
+    query = session.query(Follows.channel, Follows.channel_id).filter(Follows.user_id == user_id)
+    return query.order_by(asc(Follows.channel)).all()
+
+
+@db_operation
+def insert_follows(session, rows):
+    if not rows:
+        return 0
+    # Rows already covered by the unique (user_id, channel) index are skipped
+    statement = Follows.__table__.insert().prefix_with('OR IGNORE')
+    return session.execute(statement, rows).rowcount
+
+
+@db_operation
+def delete_follows(session, user_id, channels=None):
+    query = session.query(Follows).filter(Follows.user_id == user_id)
+    if channels is not None:
+        query = query.filter(Follows.channel.in_(channels))
+    removed = query.with_entities(Follows.channel, Follows.channel_id).all()
+    query.delete(synchronize_session=False)
+    return removed
+
+
+@db_operation
+def count_follows(session):
+    users = session.query(func.count(distinct(Follows.user_id))).scalar()
+    follows = session.query(func.count(Follows.id)).scalar()
+    return users, follows
+
+
+@db_operation
+def get_followed_channel_ids(session):
+    rows = session.query(distinct(Follows.channel_id)).all()
+    return [channel_id for channel_id, in rows]
+
+
+@db_operation
+def scan_follows(session, consume, batch_size=10000):
+    # Rows are streamed in batches instead of loading the whole table at once
+    query = session.query(Follows.channel_id, Follows.user_id, Follows.channel).yield_per(batch_size)
+    for channel_id, user_id, channel in query:
+        consume(channel_id, user_id, channel)
+
+
+@db_operation
+def get_channel_followers(session, channel_id):
+    rows = session.query(distinct(Follows.user_id)).filter(Follows.channel_id == channel_id).all()
+    return [user_id for user_id, in rows]
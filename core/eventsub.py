@@ -0,0 +1,217 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+from datetime import datetime, timedelta
+
+import discord
+from aiohttp import web
+from pytz import timezone
+
+from bot import load_config
+from . import db
+from .cache import MISSING, TTLCache
+from .follows import follower_index
+from .http import http_client, RateLimiter
+from .poller import poller
+from .utils import HELIX_URL, twitch_limiter, twitch_convert_timestamp
+
+config = load_config()
+log = logging.getLogger('discord')
+
+
+class EventSub:
+    """
+    EventSub webhook receiver and subscription manager for go-live notifications
+    """
+
+    TYPES = ('stream.online', 'stream.offline')
+
+    def __init__(self, enabled=False, host='0.0.0.0', port=8080, callback='', secret='', resync_interval=600):
+        self.enabled = enabled
+        self.host = host
+        self.port = port
+        self.callback = callback
+        self.secret = secret
+        self.resync_interval = resync_interval
+        self.bot = None
+        self.subscriptions = {}
+        self._seen = TTLCache(maxsize=10000, ttl=600)
+        self._runner = None
+
+    async def start(self, bot):
+        if self._runner is not None:
+            return
+        if not self.secret:
+            # Signatures made with an empty key can be forged by anyone who knows the callback URL
+            log.error('EventSub is enabled without a secret, not starting the webhook receiver')
+            return
+        self.bot = bot
+
+        app = web.Application()
+        app.router.add_post('/eventsub', self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        await self.sync()
+
+        if config['bot'].get('processes', 1) > 1:
+            # Follows added on other workers are only picked up by a periodic sync
+            bot.loop.create_task(self.resync())
+
+    async def resync(self):
+        while self._runner is not None:
+            await asyncio.sleep(self.resync_interval)
+            try:
+                await self.sync()
+            except Exception:
+                log.exception('Failed to sync EventSub subscriptions')
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def verify(self, headers, body):
+        if not self.secret:
+            return False
+        try:
+            message_id = headers['Twitch-Eventsub-Message-Id']
+            timestamp = headers['Twitch-Eventsub-Message-Timestamp']
+            signature = headers['Twitch-Eventsub-Message-Signature']
+        except KeyError:
+            return False
+
+        # Reject replays of old messages even when the signature is valid
+        age = datetime.now(timezone('UTC')) - twitch_convert_timestamp(timestamp)
+        if age > timedelta(minutes=10):
+            return False
+
+        message = message_id.encode() + timestamp.encode() + body
+        expected = 'sha256=' + hmac.new(self.secret.encode(), message, hashlib.sha256).hexdigest()
+        return hmac.compare_digest(expected, signature)
+
+    async def handle(self, request):
+        body = await request.read()
+        if not self.verify(request.headers, body):
+            return web.Response(status=403)
+
+        # Twitch retries deliveries, so each message is only processed once
+        message_id = request.headers['Twitch-Eventsub-Message-Id']
+        if self._seen.get(message_id) is not MISSING:
+            return web.Response(status=204)
+        self._seen.set(message_id, True)
+
+        data = json.loads(body.decode('utf-8'))
+        message_type = request.headers.get('Twitch-Eventsub-Message-Type')
+        subscription = data['subscription']
+        channel_id = subscription['condition']['broadcaster_user_id']
+
+        if message_type == 'webhook_callback_verification':
+            return web.Response(text=data['challenge'])
+        elif message_type == 'revocation':
+            self.subscriptions.get(channel_id, {}).pop(subscription['type'], None)
+        elif message_type == 'notification':
+            self.bot.loop.create_task(self.dispatch(subscription['type'], data['event']))
+        return web.Response(status=204)
+
+    async def dispatch(self, event_type, event):
+        channel_id = event['broadcaster_user_id']
+        channel = event['broadcaster_user_login']
+
+        if event_type == 'stream.online':
+            description = f'Channel {channel} is now live'
+        else:
+            poller.streams.pop(channel_id, None)
+            description = f'Channel {channel} is now offline'
+
+        embed = discord.Embed(description=description)
+        embed.add_field(name='URL', value=f'https://www.twitch.tv/{channel}', inline=False)
+        embed.colour = 0x9b59b6
+
+        followers = await follower_index.get(channel_id)
+        await asyncio.gather(*[self.notify(user_id, embed) for user_id in followers])
+
+    async def notify(self, user_id, embed):
+        try:
+            # Users only seen by shards on other workers are not in this worker's cache
+            user = self.bot.get_user(user_id) or await self.bot.get_user_info(user_id)
+            await user.send(embed=embed)
+        except discord.HTTPException:
+            log.warning(f'Cannot send stream notification to user {user_id}')
+
+    async def helix_request(self, method, endpoint, payload=None):
+        headers = {
+            'Authorization': 'Bearer ' + config['twitch']['token'],
+            'Client-Id': config['twitch']['client_id']
+        }
+        await twitch_limiter.acquire(RateLimiter.BACKGROUND)
+        async with http_client.request(method, f'{HELIX_URL}/{endpoint}', headers=headers, json=payload) as resp:
+            twitch_limiter.update(resp.headers)
+            data = await resp.json() if resp.status != 204 else None
+            if resp.status >= 400:
+                log.warning(f'EventSub {method} {endpoint} failed with status {resp.status}')
+            return resp.status, data
+
+    async def sync(self):
+        self.subscriptions = {}
+        cursor = ''
+        while True:
+            status, data = await self.helix_request('GET', f'eventsub/subscriptions?after={cursor}')
+            if status != 200:
+                break
+            for subscription in data['data']:
+                if subscription['transport'].get('callback') != self.callback:
+                    continue
+                channel_id = subscription['condition']['broadcaster_user_id']
+                self.subscriptions.setdefault(channel_id, {})[subscription['type']] = subscription['id']
+            cursor = data.get('pagination', {}).get('cursor')
+            if not cursor:
+                break
+
+        rows = await db.get_followed_channel_ids()
+        followed = {str(channel_id) for channel_id in rows}
+        await self.channels_added(followed)
+        await self.channels_removed(set(self.subscriptions) - followed)
+
+    async def subscribe(self, channel_id):
+        subscriptions = self.subscriptions.setdefault(channel_id, {})
+        for event_type in self.TYPES:
+            if event_type in subscriptions:
+                continue
+            payload = {
+                'type': event_type,
+                'version': '1',
+                'condition': {'broadcaster_user_id': channel_id},
+                'transport': {'method': 'webhook', 'callback': self.callback, 'secret': self.secret}
+            }
+            status, data = await self.helix_request('POST', 'eventsub/subscriptions', payload)
+            if status == 202:
+                subscriptions[event_type] = data['data'][0]['id']
+
+    async def unsubscribe(self, channel_id):
+        subscriptions = self.subscriptions.pop(channel_id, {})
+        for subscription_id in subscriptions.values():
+            await self.helix_request('DELETE', f'eventsub/subscriptions?id={subscription_id}')
+
+    async def channels_added(self, channel_ids):
+        if self._runner is None:
+            return
+        channel_ids = {str(channel_id) for channel_id in channel_ids}
+        await asyncio.gather(*[
+            self.subscribe(channel_id) for channel_id in channel_ids
+            if len(self.subscriptions.get(channel_id, {})) < len(self.TYPES)
+        ])
+
+    async def channels_removed(self, channel_ids):
+        if self._runner is None:
+            return
+        # Only drop subscriptions for channels nobody follows any more
+        for channel_id in {str(channel_id) for channel_id in channel_ids}:
+            if channel_id in self.subscriptions and not await follower_index.get(channel_id):
+                await self.unsubscribe(channel_id)
+
+
+eventsub = EventSub(**config.get('eventsub', {}))
@@ -0,0 +1,188 @@
+import asyncio
+import heapq
+import logging
+import sys
+import time
+from collections import Counter, namedtuple
+
+from . import db
+from .cache import MISSING, TTLCache
+from .http import SingleFlight
+
+log = logging.getLogger('discord')
+
+
+class FollowRecord(namedtuple('FollowRecord', 'channel channel_id')):
+    __slots__ = ()
+
+
+class FollowIndex:
+    """
+    In-memory index of each user's follows, loaded lazily and kept current on write
+    """
+
+    def __init__(self, maxsize=10000, ttl=600):
+        # The TTL bounds how long writes made by other worker processes go unseen
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._flight = SingleFlight()
+        self._versions = Counter()
+
+    async def get(self, user_id):
+        follows = self.cache.get(user_id)
+        if follows is MISSING:
+            follows = await self._flight.run(user_id, self._load, user_id)
+        return follows
+
+    async def _load(self, user_id):
+        version = self._versions[user_id]
+        rows = await db.get_follow_records(user_id)
+        follows = tuple(FollowRecord(channel, channel_id) for channel, channel_id in rows)
+        # A write during the load may not be in the rows read, so the result is not kept
+        if self._versions[user_id] == version:
+            self.cache.set(user_id, follows)
+        return follows
+
+    def added(self, user_id, rows):
+        self._versions[user_id] += 1
+        follows = self.cache.get(user_id)
+        if follows is MISSING:
+            return
+        # Rows for channels already followed were ignored by the insert
+        merged = {follow.channel: follow for follow in follows}
+        for row in rows:
+            merged.setdefault(row['channel'], FollowRecord(row['channel'], row['channel_id']))
+        self.cache.set(user_id, tuple(sorted(merged.values())))
+
+    def removed(self, user_id, removed):
+        self._versions[user_id] += 1
+        follows = self.cache.get(user_id)
+        if follows is MISSING:
+            return
+        channels = {channel for channel, channel_id in removed}
+        self.cache.set(user_id, tuple(follow for follow in follows if follow.channel not in channels))
+
+
+class FollowerIndex:
+    """
+    Reverse index of channel_id to following user IDs, built in one scan and updated on write
+    """
+
+    def __init__(self):
+        self.followers = {}
+        self.channels = {}
+        self.ready = False
+        self._pending = None
+        self._task = None
+
+    def start(self, loop, rebuild_interval=None):
+        if self._task is None:
+            self._task = loop.create_task(self.run(rebuild_interval))
+
+    async def run(self, rebuild_interval):
+        while True:
+            try:
+                await self.build()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception('Failed to build follower index')
+                await asyncio.sleep(60)
+                continue
+            if rebuild_interval is None:
+                return
+            # Writes made by other worker processes only arrive with a rebuild
+            await asyncio.sleep(rebuild_interval)
+
+    async def build(self):
+        followers = {}
+        channels = {}
+        rows = 0
+
+        def consume(channel_id, user_id, channel):
+            nonlocal rows
+            rows += 1
+            users = followers.get(channel_id)
+            if users is None:
+                users = followers[channel_id] = set()
+                channels[channel_id] = channel
+            users.add(user_id)
+
+        # Writes made while the scan runs are replayed onto the new index once it finishes
+        self._pending = []
+        try:
+            start = time.perf_counter()
+            await db.scan_follows(consume)
+            elapsed = (time.perf_counter() - start) * 1000
+            size = await asyncio.get_event_loop().run_in_executor(None, self.memory_usage, followers, channels)
+            for apply, args in self._pending:
+                apply(followers, channels, *args)
+        finally:
+            self._pending = None
+
+        self.followers = followers
+        self.channels = channels
+        self.ready = True
+        log.info(
+            f'Built follower index of {rows} follows over {len(followers)} channels '
+            f'in {elapsed:.0f} ms using about {size / 1024 / 1024:.1f} MiB'
+        )
+
+    @staticmethod
+    def memory_usage(followers, channels):
+        # Containers plus their contents; an integer shared between sets is counted for each
+        size = sys.getsizeof(followers) + sys.getsizeof(channels)
+        for channel_id, users in followers.items():
+            size += sys.getsizeof(channel_id) + sys.getsizeof(users) + sum(map(sys.getsizeof, users))
+        for channel in channels.values():
+            size += sys.getsizeof(channel)
+        return size
+
+    async def get(self, channel_id):
+        if not self.ready:
+            return set(await db.get_channel_followers(int(channel_id)))
+        return self.followers.get(int(channel_id), frozenset())
+
+    def popular(self, count):
+        top = heapq.nlargest(count, self.followers.items(), key=lambda item: len(item[1]))
+        return [(channel_id, self.channels[channel_id], len(users)) for channel_id, users in top]
+
+    def added(self, user_id, rows):
+        if self._pending is not None:
+            self._pending.append((self._add, (user_id, rows)))
+        self._add(self.followers, self.channels, user_id, rows)
+
+    def removed(self, user_id, removed):
+        if self._pending is not None:
+            self._pending.append((self._remove, (user_id, removed)))
+        self._remove(self.followers, self.channels, user_id, removed)
+
+    @staticmethod
+    def _add(followers, channels, user_id, rows):
+        for row in rows:
+            followers.setdefault(row['channel_id'], set()).add(user_id)
+            channels.setdefault(row['channel_id'], row['channel'])
+
+    @staticmethod
+    def _remove(followers, channels, user_id, removed):
+        for channel, channel_id in removed:
+            users = followers.get(channel_id)
+            if users is None:
+                continue
+            users.discard(user_id)
+            if not users:
+                del followers[channel_id]
+                channels.pop(channel_id, None)
+
+
+follow_index = FollowIndex()
+follower_index = FollowerIndex()
+
+
+def follows_added(user_id, rows):
+    follow_index.added(user_id, rows)
+    follower_index.added(user_id, rows)
+
+
+def follows_removed(user_id, removed):
+    follow_index.removed(user_id, removed)
+    follower_index.removed(user_id, removed)
@@ -0,0 +1,74 @@
+import asyncio
+import time
+from collections import deque, namedtuple
+
+import psutil
+
+from .watchdog import watchdog
+
+Sample = namedtuple('Sample', 'timestamp cpu_system cpu_user memory process_cpu rss fds tasks loop_lag')
+
+# asyncio.all_tasks only exists from Python 3.7
+all_tasks = getattr(asyncio, 'all_tasks', None) or asyncio.Task.all_tasks
+
+
+class HostSampler:
+    """
+    Background sampler keeping a rolling window of host and bot process statistics
+    """
+
+    def __init__(self, interval=10, window=360):
+        self.interval = interval
+        self.samples = deque(maxlen=window)
+        self.process = psutil.Process()
+        self._task = None
+
+    def start(self, loop):
+        if self._task is not None:
+            return
+        # Non-blocking percentages are relative to the previous call, so prime them first
+        psutil.cpu_times_percent(interval=None)
+        self.process.cpu_percent(interval=None)
+        self._task = loop.create_task(self.run())
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.sample()
+
+    def sample(self):
+        cpu = psutil.cpu_times_percent(interval=None)
+        memory = psutil.virtual_memory()
+        with self.process.oneshot():
+            process_cpu = self.process.cpu_percent(interval=None)
+            rss = self.process.memory_info().rss
+            fds = self.process.num_fds() if hasattr(self.process, 'num_fds') else self.process.num_handles()
+
+        sample = Sample(
+            timestamp=time.time(),
+            cpu_system=cpu.system,
+            cpu_user=cpu.user,
+            memory=memory.percent,
+            process_cpu=process_cpu,
+            rss=rss / 1024 / 1024,
+            fds=fds,
+            tasks=len(all_tasks()),
+            loop_lag=watchdog.lag * 1000
+        )
+        self.samples.append(sample)
+        return sample
+
+    def summary(self, minutes):
+        since = time.time() - minutes * 60
+        samples = [sample for sample in self.samples if sample.timestamp >= since]
+        if not samples:
+            samples = [self.sample()]
+
+        summary = {}
+        for field in Sample._fields[1:]:
+            values = [getattr(sample, field) for sample in samples]
+            summary[field] = (min(values), sum(values) / len(values), max(values))
+        return len(samples), summary
+
+
+sampler = HostSampler()
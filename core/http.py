@@ -0,0 +1,227 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+import aiohttp
+
+
+class HTTPClient:
+    """
+    Shared aiohttp client with a bounded keep-alive connection pool
+    """
+
+    def __init__(self, limit=100, limit_per_host=20, dns_cache_ttl=300, keepalive_timeout=60):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self._session = None
+
+    @property
+    def session(self):
+        # Created lazily so the session binds to the running event loop
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                use_dns_cache=True,
+                ttl_dns_cache=self.dns_cache_ttl,
+                keepalive_timeout=self.keepalive_timeout
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', 60)
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+class SingleFlight:
+    """
+    Share one in-flight call between concurrent callers using the same key
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.deduplicated = 0
+        self._inflight = {}
+
+    async def run(self, key, func, *args):
+        self.calls += 1
+        future = self._inflight.get(key)
+
+        if future is None:
+            future = asyncio.ensure_future(func(*args))
+            self._inflight[key] = future
+            future.add_done_callback(lambda f: self._forget(key, f))
+        else:
+            self.deduplicated += 1
+        # Shielded so one cancelled waiter does not cancel the call for the others
+        return await asyncio.shield(future)
+
+    def _forget(self, key, future):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'deduplicated': self.deduplicated,
+            'in_flight': len(self._inflight)
+        }
+
+
+class BatchLoader:
+    """
+    Collect keys requested within a short window and load them in one batch
+    """
+
+    def __init__(self, load_batch, max_size=100, delay=0.005):
+        self.load_batch = load_batch
+        self.max_size = max_size
+        self.delay = delay
+        self.loads = 0
+        self.batches = 0
+        self._pending = {}
+        self._handle = None
+
+    async def load(self, key):
+        self.loads += 1
+        future = self._pending.get(key)
+
+        if future is None:
+            future = asyncio.get_event_loop().create_future()
+            self._pending[key] = future
+            if len(self._pending) >= self.max_size:
+                self._dispatch()
+            elif self._handle is None:
+                self._handle = asyncio.get_event_loop().call_later(self.delay, self._dispatch)
+        return await asyncio.shield(future)
+
+    def _dispatch(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        pending, self._pending = self._pending, {}
+
+        if pending:
+            self.batches += 1
+            asyncio.ensure_future(self._run(pending))
+
+    async def _run(self, pending):
+        try:
+            results = await self.load_batch(list(pending))
+        except Exception as e:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            # Keys left out of the results could not be loaded, as opposed to loading as None
+            for key, future in pending.items():
+                if future.done():
+                    continue
+                if key in results:
+                    future.set_result(results[key])
+                else:
+                    future.set_exception(LookupError(f'Failed to load {key}'))
+
+    def stats(self):
+        return {
+            'loads': self.loads,
+            'batches': self.batches
+        }
+
+
+class RateLimiter:
+    """
+    Token bucket that follows the Ratelimit-* headers returned by Helix
+    """
+
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+    def __init__(self, limit=800, period=60, workers=1):
+        # Worker processes share one Helix bucket, so each keeps to its slice of it
+        self.workers = workers
+        self.limit = limit // workers
+        self.period = period
+        self.tokens = float(self.limit)
+        self.rate = self.limit / period
+        self._updated = time.monotonic()
+        self._waiters = []
+        self._order = itertools.count()
+        self._timer = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.limit, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, priority=INTERACTIVE):
+        self._refill()
+        if not self._waiters and self.tokens >= 1:
+            self.tokens -= 1
+            return
+
+        # Lower priority values are released first, FIFO within a priority
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), future))
+        self._schedule()
+        await future
+
+    def _schedule(self):
+        if self._waiters and self._timer is None:
+            delay = max(0.0, (1 - self.tokens) / self.rate)
+            self._timer = asyncio.get_event_loop().call_later(delay, self._release)
+
+    def _release(self):
+        self._timer = None
+        self._refill()
+        while self._waiters and self.tokens >= 1:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self.tokens -= 1
+                future.set_result(None)
+        self._schedule()
+
+    def update(self, headers):
+        try:
+            limit = int(headers['Ratelimit-Limit']) // self.workers
+            remaining = int(headers['Ratelimit-Remaining']) // self.workers
+            reset = float(headers['Ratelimit-Reset'])
+        except (KeyError, ValueError):
+            return
+
+        self._refill()
+        self.limit = limit
+        # Requests still in flight were already charged locally, so keep the lower count
+        self.tokens = min(self.tokens, float(remaining))
+        until_reset = reset - time.time()
+        if remaining < limit and until_reset > 0:
+            self.rate = (limit - remaining) / until_reset
+        else:
+            self.rate = limit / self.period
+
+    def exhaust(self):
+        self._refill()
+        self.tokens = min(self.tokens, 0.0)
+
+    def stats(self):
+        self._refill()
+        return {
+            'limit': self.limit,
+            'remaining': int(self.tokens),
+            'queued': len(self._waiters)
+        }
+
+
+http_client = HTTPClient()
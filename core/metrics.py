@@ -0,0 +1,138 @@
+import threading
+import time
+
+from aiohttp import web
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = [
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    ]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class Registry:
+    """
+    Collection of metrics rendered in the Prometheus text format
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class Metric:
+    type = 'untyped'
+
+    def __init__(self, name, documentation, labels=(), callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.callback = callback
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def samples(self):
+        # Callback metrics read their values from existing counters at scrape time
+        values = self.callback() if self.callback is not None else dict(self._values)
+        for label_values, value in sorted(values.items()):
+            yield self.name, format_labels(self.labels, label_values), value
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            counts, total, count = self._values.get(label_values, ([0] * len(self.buckets), 0.0, 0))
+            counts = [c + 1 if value <= bound else c for c, bound in zip(counts, self.buckets)]
+            self._values[label_values] = (counts, total + value, count + 1)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for label_values, (counts, total, count) in sorted(values.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                yield f'{self.name}_bucket', format_labels(self.labels, label_values, [('le', bound)]), bucket_count
+            yield f'{self.name}_bucket', format_labels(self.labels, label_values, [('le', '+Inf')]), count
+            yield f'{self.name}_sum', format_labels(self.labels, label_values), total
+            yield f'{self.name}_count', format_labels(self.labels, label_values), count
+
+    def time(self, *label_values):
+        return _Timer(self, label_values)
+
+
+class _Timer:
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+
+
+loop_lag = Gauge('event_loop_lag_seconds', 'Delay between scheduled and actual event loop wakeups')
+
+
+async def handle_metrics(request):
+    return web.Response(
+        body=registry.render().encode('utf-8'),
+        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+    )
+
+
+async def start_server(host='127.0.0.1', port=9090):
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    return runner
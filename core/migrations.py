@@ -0,0 +1,23 @@
+# Each entry upgrades the schema by one version, tracked in SQLite's user_version
+MIGRATIONS = [
+    [
+        # Drop duplicate follows so the unique index can be created
+        'DELETE FROM follows WHERE id NOT IN (SELECT MIN(id) FROM follows GROUP BY user_id, channel)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS ix_follows_user_id_channel ON follows (user_id, channel)',
+        'CREATE INDEX IF NOT EXISTS ix_follows_channel_id ON follows (channel_id)'
+    ],
+    [
+        # Channel names are saved as lowercase logins, so follows saved as typed are folded into them
+        'DELETE FROM follows WHERE id NOT IN (SELECT MIN(id) FROM follows GROUP BY user_id, lower(channel))',
+        'UPDATE follows SET channel = lower(channel)'
+    ]
+]
+
+
+def migrate(engine):
+    with engine.begin() as connection:
+        version = connection.execute('PRAGMA user_version').scalar()
+        for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+            for statement in statements:
+                connection.execute(statement)
+            connection.execute(f'PRAGMA user_version = {number}')
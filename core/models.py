@@ -1,17 +1,22 @@
 from datetime import datetime
 
-from sqlalchemy import Column, Integer, String, BigInteger, DateTime
-from sqlalchemy import create_engine
+from sqlalchemy import Column, Integer, String, BigInteger, DateTime, Index
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 from bot import load_config
+from .migrations import migrate
 
 Base = declarative_base()
 
 
 class Follows(Base):
     __tablename__ = 'follows'
+    __table_args__ = (
+        Index('ix_follows_user_id_channel', 'user_id', 'channel', unique=True),
+        Index('ix_follows_channel_id', 'channel_id')
+    )
     id = Column(Integer, primary_key=True)
     user_id = Column(BigInteger, nullable=False)
     username = Column(String(255), nullable=False)
@@ -22,9 +27,25 @@ class Follows(Base):
 
 config = load_config()
 
-engine = create_engine('sqlite:///bot.db', echo=config['bot']['debug'])
+# Sessions are opened per operation on the core.db worker threads
+engine = create_engine(
+    'sqlite:///bot.db',
+    echo=config['bot']['debug'],
+    connect_args={'check_same_thread': False}
+)
+
+
+@event.listens_for(engine, 'connect')
+def set_sqlite_pragma(dbapi_connection, connection_record):
+    # WAL lets worker processes read while another one writes
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA busy_timeout=5000')
+    cursor.close()
+
+
 Base.metadata.create_all(engine)
+migrate(engine)
 Base.metadata.bind = engine
 
-Session = sessionmaker(bind=engine)
-session = Session()
+Session = sessionmaker(bind=engine, expire_on_commit=False)
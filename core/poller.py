@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import time
+from collections import namedtuple
+
+from bot import load_config
+from . import db
+from .cache import MISSING, create_cache
+from .utils import retrieve_twitch_streams
+
+config = load_config()
+log = logging.getLogger('discord')
+
+
+class StreamSnapshot(namedtuple('StreamSnapshot', 'viewer_count started_at game_id title')):
+    __slots__ = ()
+
+    @classmethod
+    def from_data(cls, stream):
+        return cls(stream['viewer_count'], stream['started_at'], stream['game_id'], stream['title'])
+
+
+class StreamPoller:
+    """
+    Background poller keeping live status for every followed channel in memory
+    """
+
+    def __init__(self, interval=60, max_age=120, store=None):
+        self.interval = interval
+        self.max_age = max_age
+        self.store = store
+        self.streams = {}
+        self.channel_ids = frozenset()
+        self.updated = None
+        self._task = None
+
+    def start(self, loop):
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self.run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def run(self):
+        if self.store is not None:
+            await self.store.ready()
+        if self.load():
+            # A snapshot saved before a restart is reused until it would have been refreshed anyway
+            await asyncio.sleep(max(0.0, self.interval - (time.monotonic() - self.updated)))
+        while True:
+            try:
+                await self.poll()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception('Failed to poll twitch stream status')
+            await asyncio.sleep(self.interval)
+
+    async def poll(self):
+        rows = await db.get_followed_channel_ids()
+        channel_ids = frozenset(str(channel_id) for channel_id in rows)
+        streams, fetched = await retrieve_twitch_streams(None, channel_ids)
+
+        # Channels whose chunk failed keep their previous entry but are not counted as covered,
+        # so commands fetch them again instead of reporting them offline
+        snapshot = {
+            channel_id: stream for channel_id, stream in self.streams.items()
+            if channel_id in channel_ids and channel_id not in fetched
+        }
+        snapshot.update(
+            (channel_id, StreamSnapshot.from_data(stream)) for channel_id, stream in streams.items()
+        )
+        self.streams = snapshot
+        self.channel_ids = frozenset(fetched)
+        self.updated = time.monotonic()
+        self.save()
+
+    def save(self):
+        if self.store is None:
+            return
+        self.store.set('snapshot', {
+            'streams': {channel_id: list(snapshot) for channel_id, snapshot in self.streams.items()},
+            'channel_ids': list(self.channel_ids),
+            'updated': time.time()
+        }, ttl=self.max_age)
+
+    def load(self):
+        data = self.store.get('snapshot') if self.store is not None else MISSING
+        if data is MISSING:
+            return False
+
+        age = time.time() - data['updated']
+        self.streams = {
+            channel_id: StreamSnapshot(*snapshot) for channel_id, snapshot in data['streams'].items()
+        }
+        self.channel_ids = frozenset(data['channel_ids'])
+        self.updated = time.monotonic() - age
+        return True
+
+    def is_fresh(self):
+        return self.updated is not None and time.monotonic() - self.updated <= self.max_age
+
+    async def get_streams(self, ctx, channel_ids):
+        channel_ids = [str(channel_id) for channel_id in channel_ids]
+        if not self.is_fresh():
+            # Workers that do not poll read the snapshot saved by the one that does
+            self.load()
+        if self.is_fresh():
+            # Channels followed since the last poll are not in the snapshot yet
+            missing = [channel_id for channel_id in channel_ids if channel_id not in self.channel_ids]
+        else:
+            missing = channel_ids
+
+        streams = {
+            channel_id: self.streams[channel_id] for channel_id in channel_ids if channel_id in self.streams
+        }
+        if missing:
+            fetched_streams, fetched = await retrieve_twitch_streams(ctx, missing)
+            # A previous snapshot entry is still the best answer for channels that could not be fetched
+            for channel_id in fetched:
+                streams.pop(channel_id, None)
+            for channel_id, stream in fetched_streams.items():
+                streams[channel_id] = StreamSnapshot.from_data(stream)
+        return streams
+
+
+poller = StreamPoller(
+    interval=config['twitch'].get('poll_interval', 60),
+    max_age=config['twitch'].get('snapshot_max_age', 120),
+    store=create_cache('streams', maxsize=1, **config.get('cache', {}))
+)
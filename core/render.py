@@ -0,0 +1,136 @@
+import asyncio
+import logging
+
+import discord
+
+FIELD_LIMIT = 1024
+PREVIOUS = '\N{BLACK LEFT-POINTING TRIANGLE}'
+NEXT = '\N{BLACK RIGHT-POINTING TRIANGLE}'
+
+log = logging.getLogger('discord')
+
+
+class Pages:
+    """
+    Table rows split into embed pages within Discord's field limits, built as they are first viewed
+    """
+
+    def __init__(self, columns, rows, per_page=20, colour=0x738bd7):
+        self.columns = columns
+        self.per_page = per_page
+        self.colour = colour
+        self.complete = False
+        self._async = hasattr(rows, '__aiter__')
+        self._rows = rows.__aiter__() if self._async else iter(rows)
+        self._pages = []
+        self._carry = None
+
+    async def _next_row(self):
+        if self._carry is not None:
+            row, self._carry = self._carry, None
+            return row
+        if self._async:
+            try:
+                return await self._rows.__anext__()
+            except StopAsyncIteration:
+                return None
+        return next(self._rows, None)
+
+    async def _build(self):
+        page = []
+        lengths = [0] * len(self.columns)
+        while len(page) < self.per_page:
+            row = await self._next_row()
+            if row is None:
+                self.complete = True
+                break
+
+            row = tuple(str(value)[:FIELD_LIMIT] for value in row)
+            # Each value is joined onto its column with a ' \n' separator
+            added = [length + len(value) + (2 if page else 0) for length, value in zip(lengths, row)]
+            if page and max(added) > FIELD_LIMIT:
+                self._carry = row
+                break
+            page.append(row)
+            lengths = added
+        return page
+
+    async def get(self, index):
+        while len(self._pages) <= index and not self.complete:
+            page = await self._build()
+            if page:
+                self._pages.append(page)
+        return self._pages[index] if index < len(self._pages) else None
+
+    async def render(self, ctx, index):
+        page = await self.get(index)
+        embed = discord.Embed()
+        for column, values in zip(self.columns, zip(*page)):
+            embed.add_field(name=column, value=' \n'.join(values))
+
+        footer = f'Requested by {ctx.message.author}'
+        # Looking one page ahead is enough to know whether to show page numbers
+        if index > 0 or await self.get(index + 1) is not None:
+            footer += f' | Page {index + 1}'
+            if self.complete:
+                footer += f' of {len(self._pages)}'
+        embed.set_footer(text=footer)
+        embed.colour = self.colour
+        return embed
+
+
+async def send_pages(ctx, columns, rows, per_page=20, colour=0x738bd7, timeout=120):
+    """
+    Send the first page of rows and page through the rest with reactions
+
+    Returns None without sending anything when there are no rows.
+    """
+    pages = Pages(columns, rows, per_page=per_page, colour=colour)
+    if await pages.get(0) is None:
+        return None
+
+    message = await ctx.send(embed=await pages.render(ctx, 0))
+    if await pages.get(1) is not None:
+        # Paging outlives the command, so it does not hold up the command's completion
+        ctx.bot.loop.create_task(paginate(ctx, message, pages, timeout))
+    return message
+
+
+async def paginate(ctx, message, pages, timeout):
+    try:
+        for emoji in (PREVIOUS, NEXT):
+            await message.add_reaction(emoji)
+    except discord.HTTPException:
+        return
+
+    def check(reaction, user):
+        return reaction.message.id == message.id and user == ctx.author and str(reaction.emoji) in (PREVIOUS, NEXT)
+
+    index = 0
+    while True:
+        try:
+            reaction, user = await ctx.bot.wait_for('reaction_add', check=check, timeout=timeout)
+        except asyncio.TimeoutError:
+            break
+
+        try:
+            if str(reaction.emoji) == NEXT and await pages.get(index + 1) is not None:
+                await message.edit(embed=await pages.render(ctx, index + 1))
+                index += 1
+            elif str(reaction.emoji) == PREVIOUS and index > 0:
+                await message.edit(embed=await pages.render(ctx, index - 1))
+                index -= 1
+        except Exception:
+            # Paging runs as its own task, so a failed page would otherwise end it silently
+            log.exception(f'Failed to show page for {ctx.command}')
+            break
+
+        try:
+            await message.remove_reaction(reaction.emoji, user)
+        except discord.HTTPException:
+            pass
+
+    try:
+        await message.clear_reactions()
+    except discord.HTTPException:
+        pass
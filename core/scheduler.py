@@ -0,0 +1,124 @@
+import asyncio
+from collections import Counter, deque, namedtuple
+
+import discord
+
+from bot import load_config
+from .utils import embed_message
+
+config = load_config()
+
+Ticket = namedtuple('Ticket', 'command user_id guild_id cost')
+
+
+class FairScheduler:
+    """
+    Admit API-heavy commands under per-user, per-guild and total cost limits
+    """
+
+    def __init__(self, capacity=50, per_user=1, per_guild=3):
+        self.capacity = capacity
+        self.per_user = per_user
+        self.per_guild = per_guild
+        self.used = 0
+        self.admitted = 0
+        self.queued = 0
+        self._users = Counter()
+        self._guilds = Counter()
+        self._waiters = deque()
+
+    def _within_limits(self, ticket):
+        if self._users[ticket.user_id] >= self.per_user:
+            return False
+        return ticket.guild_id is None or self._guilds[ticket.guild_id] < self.per_guild
+
+    def _fits(self, ticket):
+        # An idle scheduler always admits, so no cost can wait forever
+        return self.used == 0 or self.used + ticket.cost <= self.capacity
+
+    def _can_admit(self, ticket):
+        if not self._within_limits(ticket) or not self._fits(ticket):
+            return False
+        # Newcomers do not overtake an older waiter that is only held back by capacity
+        return not any(
+            self._within_limits(waiter) and not self._fits(waiter) for waiter, _ in self._waiters)
+
+    def _admit(self, ticket):
+        self._users[ticket.user_id] += 1
+        if ticket.guild_id is not None:
+            self._guilds[ticket.guild_id] += 1
+        self.used += ticket.cost
+        self.admitted += 1
+
+    async def acquire(self, ctx, cost):
+        guild_id = ctx.guild.id if ctx.guild is not None else None
+        ticket = Ticket(ctx.command, ctx.author.id, guild_id, max(1, min(cost, self.capacity)))
+
+        if self._can_admit(ticket):
+            self._admit(ticket)
+            ctx.ticket = ticket
+            return
+
+        future = asyncio.get_event_loop().create_future()
+        self._waiters.append((ticket, future))
+        self.queued += 1
+        placeholder = None
+        try:
+            placeholder = await embed_message(
+                ctx, message_type='Info', message='Queued behind other requests, working on it')
+            await future
+        except (asyncio.CancelledError, discord.HTTPException):
+            if future.done() and not future.cancelled():
+                self._release(ticket)
+            else:
+                future.cancel()
+                self._waiters.remove((ticket, future))
+            raise
+        finally:
+            if placeholder is not None:
+                try:
+                    await placeholder.delete()
+                except discord.HTTPException:
+                    pass
+        ctx.ticket = ticket
+
+    def release(self, ctx):
+        ticket = getattr(ctx, 'ticket', None)
+        # Group and subcommand hooks both run, so only the command holding the ticket releases it
+        if ticket is not None and ticket.command is ctx.command:
+            ctx.ticket = None
+            self._release(ticket)
+
+    def _release(self, ticket):
+        self._users[ticket.user_id] -= 1
+        if not self._users[ticket.user_id]:
+            del self._users[ticket.user_id]
+        if ticket.guild_id is not None:
+            self._guilds[ticket.guild_id] -= 1
+            if not self._guilds[ticket.guild_id]:
+                del self._guilds[ticket.guild_id]
+        self.used -= ticket.cost
+        self._wake()
+
+    def _wake(self):
+        # Oldest waiters go first; one waiting for capacity holds back everyone behind it
+        for ticket, future in list(self._waiters):
+            if future.done() or not self._within_limits(ticket):
+                continue
+            if not self._fits(ticket):
+                break
+            self._waiters.remove((ticket, future))
+            self._admit(ticket)
+            future.set_result(None)
+
+    def stats(self):
+        return {
+            'used': self.used,
+            'capacity': self.capacity,
+            'admitted': self.admitted,
+            'queued': self.queued,
+            'waiting': len(self._waiters)
+        }
+
+
+scheduler = FairScheduler(**config.get('scheduler', {}))
@@ -0,0 +1,73 @@
+import logging
+import multiprocessing
+import time
+
+log = logging.getLogger('discord')
+
+
+def shard_ranges(shard_count, processes):
+    """
+    Split shard IDs into contiguous ranges, one per worker process
+    """
+    if processes > shard_count:
+        raise ValueError(f'Cannot split {shard_count} shards between {processes} processes')
+    size, extra = divmod(shard_count, processes)
+    ranges = []
+    start = 0
+    for worker in range(processes):
+        end = start + size + (1 if worker < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+class Supervisor:
+    """
+    Run shard ranges in separate worker processes and restart any that crash
+    """
+
+    def __init__(self, target, shard_count, processes, restart_delay=5):
+        self.target = target
+        self.shard_count = shard_count
+        self.ranges = shard_ranges(shard_count, processes)
+        self.restart_delay = restart_delay
+        # Spawned workers start from a clean interpreter instead of a copy of this one
+        self.context = multiprocessing.get_context('spawn')
+        self.workers = {}
+
+    def start_worker(self, worker):
+        process = self.context.Process(
+            target=self.target,
+            args=(worker, self.ranges[worker], self.shard_count),
+            name=f'bot-worker-{worker}'
+        )
+        process.start()
+        self.workers[worker] = process
+        print(f'Started worker {worker} (pid {process.pid}) for shards {self.ranges[worker]}')
+
+    def run(self):
+        # Create and migrate the schema once instead of racing in every worker
+        import core.models  # noqa: F401
+
+        for worker in range(len(self.ranges)):
+            self.start_worker(worker)
+
+        try:
+            while self.workers:
+                time.sleep(1)
+                for worker, process in list(self.workers.items()):
+                    if process.is_alive():
+                        continue
+                    if process.exitcode == 0:
+                        # A clean exit comes from !shutdown, so the worker stays down
+                        print(f'Worker {worker} exited')
+                        del self.workers[worker]
+                    else:
+                        print(f'Worker {worker} died with exit code {process.exitcode}, restarting')
+                        time.sleep(self.restart_delay)
+                        self.start_worker(worker)
+        except KeyboardInterrupt:
+            for process in self.workers.values():
+                process.terminate()
+            for process in self.workers.values():
+                process.join()
@@ -1,36 +1,112 @@
+import asyncio
+import functools
+import logging
 from datetime import datetime, timedelta
 
 import aiohttp
 import discord
 from dateutil import parser
 from pytz import timezone
-from sqlalchemy import asc
 
 from bot import load_config
-from .models import session, Follows
+from . import metrics
+from .cache import MISSING, ResponseCache, create_cache
+from .follows import follow_index
+from .http import http_client, BatchLoader, RateLimiter, SingleFlight
 
 config = load_config()
+log = logging.getLogger('discord')
 
+HELIX_URL = config['twitch'].get('api_url', 'https://api.twitch.tv/helix')
 
-async def twitch_api_call(ctx, endpoint, channel, params):
-    async with aiohttp.ClientSession() as session:
-        url = f'https://api.twitch.tv/helix/{endpoint}{channel}{params}'
-        headers = {
-            'Authorization': 'Bearer ' + config['twitch']['token']
-        }
-        async with session.get(url, headers=headers, timeout=60) as resp:
-            data = await resp.json()
-            error_codes = [400, 401, 403, 404, 422, 429, 500, 503]
-
-            if resp.status == 200:
-                return data
-            elif resp.status in error_codes:
-                await embed_message(ctx, message_type='Error', message=data['error'])
-            elif aiohttp.ServerTimeoutError:
-                await embed_message(ctx, message_type='Error', message='Connection Timeout')
-            else:
-                await embed_message(ctx, message_type='Error', message='Unexpected Error')
-            return None
+# Logins, user IDs and game names rarely change; misses for unknown names are kept briefly
+NEGATIVE_TTL = 300
+# The sqlite backend keeps resolved names across restarts and shares them between workers
+cache_config = config.get('cache', {})
+channel_id_cache = create_cache('channel_ids', maxsize=10000, ttl=86400, **cache_config)
+channel_name_cache = create_cache('channel_names', maxsize=10000, ttl=86400, **cache_config)
+game_name_cache = create_cache('game_names', maxsize=2000, ttl=86400, **cache_config)
+# Global listings such as games/top are identical for every guild
+response_cache = ResponseCache(ttl=60, stale_ttl=600)
+caches = {
+    'channel_ids': channel_id_cache,
+    'channel_names': channel_name_cache,
+    'game_names': game_name_cache,
+    'responses': response_cache,
+    'follows': follow_index.cache
+}
+twitch_flight = SingleFlight()
+twitch_limiter = RateLimiter(workers=config['bot'].get('processes', 1))
+
+helix_latency = metrics.Histogram(
+    'twitch_api_request_duration_seconds', 'Helix request latency by endpoint', ['endpoint'])
+helix_responses = metrics.Counter(
+    'twitch_api_responses_total', 'Helix responses by endpoint and status code', ['endpoint', 'status'])
+metrics.Counter(
+    'cache_hits_total', 'Cache lookups served from memory', ['cache'],
+    callback=lambda: {(name,): cache.stats()['hits'] for name, cache in caches.items()})
+metrics.Counter(
+    'cache_misses_total', 'Cache lookups that missed', ['cache'],
+    callback=lambda: {(name,): cache.stats()['misses'] for name, cache in caches.items()})
+metrics.Gauge(
+    'cache_entries', 'Entries currently held in each cache', ['cache'],
+    callback=lambda: {(name,): len(cache) for name, cache in caches.items()})
+metrics.Counter(
+    'twitch_api_deduplicated_total', 'Helix requests served by an identical in-flight request',
+    callback=lambda: {(): twitch_flight.deduplicated})
+
+
+async def twitch_fetch(url, priority, attempts=3):
+    headers = {
+        'Authorization': 'Bearer ' + config['twitch']['token']
+    }
+    endpoint = url[len(HELIX_URL):].lstrip('/').split('?')[0]
+    for attempt in range(1, attempts + 1):
+        await twitch_limiter.acquire(priority)
+        with helix_latency.time(endpoint):
+            async with http_client.get(url, headers=headers) as resp:
+                helix_responses.inc(endpoint, resp.status)
+                twitch_limiter.update(resp.headers)
+                if resp.status == 429 and attempt < attempts:
+                    # Queue behind the refill instead of failing the command
+                    twitch_limiter.exhaust()
+                    continue
+                data = await resp.json()
+                return resp.status, data
+
+
+async def twitch_api_call(ctx, endpoint, channel, params, priority=None):
+    url = f'{HELIX_URL}/{endpoint}{channel}{params}'
+    # Commands are served before background work when the bucket runs dry
+    if priority is None:
+        priority = RateLimiter.BACKGROUND if ctx is None else RateLimiter.INTERACTIVE
+    # Identical concurrent requests share a single round trip
+    status, data = await twitch_flight.run(url, twitch_fetch, url, priority)
+    error_codes = [400, 401, 403, 404, 422, 429, 500, 503]
+
+    if status == 200:
+        return data
+    elif ctx is None:
+        # Background callers have nobody to report to
+        log.warning(f'Twitch API call to {endpoint} failed with status {status}')
+    elif status in error_codes:
+        await embed_message(ctx, message_type='Error', message=data['error'])
+    elif aiohttp.ServerTimeoutError:
+        await embed_message(ctx, message_type='Error', message='Connection Timeout')
+    else:
+        await embed_message(ctx, message_type='Error', message='Unexpected Error')
+    return None
+
+
+async def twitch_api_cached(ctx, endpoint, channel, params):
+    url = f'{HELIX_URL}/{endpoint}{channel}{params}'
+    try:
+        return await response_cache.get(
+            ctx, url, lambda fetch_ctx: twitch_api_call(fetch_ctx, endpoint, channel, params))
+    except LookupError:
+        if ctx is not None:
+            await embed_message(ctx, message_type='Error', message='Unexpected Error')
+        return None
 
 
 # async def generate_new_twitch_token():
@@ -45,31 +121,200 @@ async def twitch_api_call(ctx, endpoint, channel, params):
 
 
 async def retrieve_twitch_channel_id(ctx, channel_name):
-    data = await twitch_api_call(ctx, endpoint='users?login=', channel=channel_name, params='')
+    key = channel_name.lower()
+    channel = channel_id_cache.get(key)
 
-    if len(data['data']) == 1:
-        channel = data['data'][0]['id']
-        return channel
-    else:
+    if channel is MISSING:
+        data = await twitch_api_call(ctx, endpoint='users?login=', channel=channel_name, params='')
+        if data is None:
+            return None
+        if len(data['data']) == 1:
+            channel = data['data'][0]['id']
+            channel_id_cache.set(key, channel)
+            channel_name_cache.set(channel, data['data'][0]['login'])
+        else:
+            channel = None
+            channel_id_cache.set(key, channel, ttl=NEGATIVE_TTL)
+
+    if channel is None:
         await embed_message(ctx, message_type='Error', message=f'Channel {channel_name} does not exist')
+    return channel
+
+
+async def retrieve_twitch_users(ctx, channel_names):
+    logins = list({channel_name.lower() for channel_name in channel_names})
+    # Helix accepts at most 100 login parameters per users request
+    chunks = [logins[i:i + 100] for i in range(0, len(logins), 100)]
+    responses = await asyncio.gather(*[
+        twitch_api_call(ctx, endpoint='users?login=', channel='&login='.join(chunk), params='')
+        for chunk in chunks
+    ])
+
+    users = {}
+    for chunk, data in zip(chunks, responses):
+        if data:
+            for user in data['data']:
+                users[user['login']] = user
+                channel_id_cache.set(user['login'], user['id'])
+                channel_name_cache.set(user['id'], user['login'])
+            for login in chunk:
+                if login not in users:
+                    channel_id_cache.set(login, None, ttl=NEGATIVE_TTL)
+    return users
+
+
+async def retrieve_twitch_channel_ids(ctx, channel_names):
+    channel_ids = {}
+    missing = []
+    for channel_name in channel_names:
+        key = channel_name.lower()
+        channel = channel_id_cache.get(key)
+        if channel is MISSING:
+            missing.append(key)
+        else:
+            channel_ids[key] = channel
+
+    if missing:
+        users = await retrieve_twitch_users(ctx, missing)
+        for key in missing:
+            channel_ids[key] = users[key]['id'] if key in users else None
+    return channel_ids
 
 
 async def retrieve_twitch_channel_name(ctx, channel_id):
-    data = await twitch_api_call(ctx, endpoint='users?id=', channel=channel_id, params='')
-    return data['data'][0]['login']
+    key = str(channel_id)
+    channel = channel_name_cache.get(key)
+
+    if channel is MISSING:
+        channel = await channel_name_loader.load(key)
+    return channel
+
+
+async def retrieve_twitch_channel_names(ctx, channel_ids, priority=None):
+    names = {}
+    missing = []
+    for channel_id in {str(channel_id) for channel_id in channel_ids}:
+        channel = channel_name_cache.get(channel_id)
+        if channel is MISSING:
+            missing.append(channel_id)
+        else:
+            names[channel_id] = channel
+
+    # Helix accepts at most 100 id parameters per users request
+    chunks = [missing[i:i + 100] for i in range(0, len(missing), 100)]
+    responses = await asyncio.gather(*[
+        twitch_api_call(ctx, endpoint='users?id=', channel='&id='.join(chunk), params='', priority=priority)
+        for chunk in chunks
+    ])
+    # IDs in chunks whose request failed are left out, so callers can tell them from unknown IDs
+    for chunk, data in zip(chunks, responses):
+        if data:
+            for user in data['data']:
+                names[user['id']] = user['login']
+                channel_name_cache.set(user['id'], user['login'])
+                channel_id_cache.set(user['login'], user['id'])
+            for channel_id in chunk:
+                if channel_id not in names:
+                    names[channel_id] = None
+                    channel_name_cache.set(channel_id, None, ttl=NEGATIVE_TTL)
+    return names
+
+
+async def retrieve_twitch_follows(ctx, twitch_user_id, progress=None):
+    channel_ids = []
+    cursor = None
+    while True:
+        params = f'&first=100&after={cursor}' if cursor else '&first=100'
+        data = await twitch_api_call(ctx, endpoint='users/follows?from_id=', channel=twitch_user_id, params=params)
+        if data is None:
+            return None
+
+        channel_ids.extend(follow['to_id'] for follow in data['data'])
+        if progress is not None:
+            await progress(len(channel_ids), data.get('total', len(channel_ids)))
+
+        cursor = data.get('pagination', {}).get('cursor')
+        if not cursor or not data['data']:
+            return channel_ids
+
+
+async def retrieve_twitch_streams(ctx, channel_ids):
+    channel_ids = [str(channel_id) for channel_id in channel_ids]
+    # Helix accepts at most 100 user_id parameters per streams request
+    chunks = [channel_ids[i:i + 100] for i in range(0, len(channel_ids), 100)]
+    responses = await asyncio.gather(*[
+        twitch_api_call(
+            ctx,
+            endpoint='streams?user_id=',
+            channel='&user_id='.join(chunk),
+            params='&type=live&first=100'
+        )
+        for chunk in chunks
+    ])
+
+    # Channels in chunks whose request failed are left out of fetched, so callers can tell them from offline
+    streams = {}
+    fetched = set()
+    for chunk, data in zip(chunks, responses):
+        if data:
+            fetched.update(chunk)
+            for stream in data['data']:
+                streams[stream['user_id']] = stream
+    return streams, fetched
 
 
 async def retrieve_twitch_game(ctx, game_id):
-    data = await twitch_api_call(ctx, endpoint='games?id=', channel='', params=game_id)
+    # Streams without a category have an empty game_id, which is not worth a lookup
+    if not game_id:
+        return None
+    key = str(game_id)
+    game = game_name_cache.get(key)
 
-    if len(data['data']) == 1:
-        game = data['data'][0]['name']
-        return game
-    else:
-        await embed_message(ctx, message_type='Error', message=f'Game title does not exist')
+    if game is MISSING:
+        game = await game_name_loader.load(key)
+    return game
 
 
-async def embed_message(ctx, message_type, message):
+async def retrieve_twitch_games(ctx, game_ids, priority=None):
+    games = {}
+    missing = []
+    for game_id in {str(game_id) for game_id in game_ids}:
+        game = game_name_cache.get(game_id)
+        if game is MISSING:
+            missing.append(game_id)
+        else:
+            games[game_id] = game
+
+    # Helix accepts at most 100 id parameters per games request
+    chunks = [missing[i:i + 100] for i in range(0, len(missing), 100)]
+    responses = await asyncio.gather(*[
+        twitch_api_call(ctx, endpoint='games?id=', channel='&id='.join(chunk), params='', priority=priority)
+        for chunk in chunks
+    ])
+    for chunk, data in zip(chunks, responses):
+        if data:
+            found = {game['id']: game['name'] for game in data['data']}
+            for game_id in chunk:
+                game = found.get(game_id)
+                games[game_id] = game
+                game_name_cache.set(game_id, game, ttl=None if game else NEGATIVE_TTL)
+    return games
+
+
+async def gather_lookups(ctx, lookups, message):
+    """
+    Run per-key lookups together and report a failed batch to the command once
+
+    Failed lookups come back as None next to a flag saying whether any failed.
+    """
+    results = await asyncio.gather(*lookups, return_exceptions=True)
+    failed = any(isinstance(result, Exception) for result in results)
+    if failed:
+        await embed_message(ctx, message_type='Error', message=message)
+    return [None if isinstance(result, Exception) else result for result in results], failed
+
+
+def create_embed(ctx, message_type, message):
     embed = discord.Embed(title=message_type, description=message)
     if message_type == 'Success':
         embed.colour = 0x2ecc71
@@ -78,17 +323,18 @@ async def embed_message(ctx, message_type, message):
     elif message_type == 'Info':
         embed.colour = 0x738bd7
     embed.set_footer(text=f'Requested by {ctx.message.author}')
-    return await ctx.send(embed=embed)
+    return embed
 
 
-def check_follows_exist(user_id, channel):
+async def embed_message(ctx, message_type, message):
+    return await ctx.send(embed=create_embed(ctx, message_type, message))
+
+
+async def check_follows_exist(user_id, channel):
+    follows = await follow_index.get(user_id)
     if channel is None:
-        follows = session.query(Follows).filter(
-            Follows.user_id == user_id).order_by(asc(Follows.channel)).all()
-    else:
-        follows = session.query(Follows).filter(
-            Follows.user_id == user_id, Follows.channel == channel).all()
-    return follows
+        return follows
+    return [follow for follow in follows if follow.channel == channel]
 
 
 def twitch_convert_timestamp(timestamp):
@@ -102,3 +348,12 @@ def twitch_channel_uptime(timestamp):
     ts = now - timestamp
     ts = timedelta(seconds=ts.seconds)
     return ts
+
+
+# Per-ID lookups issued close together are sent as one users?id= or games?id= request.
+# Batches mix keys from different commands, so errors are not sent to any one of them,
+# but they are only issued on behalf of commands and keep the interactive priority
+channel_name_loader = BatchLoader(
+    functools.partial(retrieve_twitch_channel_names, None, priority=RateLimiter.INTERACTIVE))
+game_name_loader = BatchLoader(
+    functools.partial(retrieve_twitch_games, None, priority=RateLimiter.INTERACTIVE))
@@ -0,0 +1,89 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from collections import deque, namedtuple
+from datetime import datetime
+
+from bot import load_config
+from . import metrics
+
+config = load_config()
+
+Blocker = namedtuple('Blocker', 'duration timestamp location stack')
+
+
+class LoopWatchdog:
+    """
+    Measure event loop scheduling delay and sample the stack of whatever blocks it
+    """
+
+    def __init__(self, interval=0.1, threshold=0.25, size=20):
+        self.interval = interval
+        self.threshold = threshold
+        self.size = size
+        self.lag = 0.0
+        self.worst = []
+        self.recent = deque(maxlen=size)
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id = None
+        self._lock = threading.Lock()
+        self._task = None
+
+    def start(self, loop):
+        if self._task is not None:
+            return
+        # Called from the loop thread, which is the thread the watcher samples
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._task = loop.create_task(self._beat())
+        threading.Thread(target=self._watch, name='loop-watchdog', daemon=True).start()
+
+    async def _beat(self):
+        while True:
+            start = time.monotonic()
+            self._heartbeat = start
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, time.monotonic() - start - self.interval)
+            metrics.loop_lag.set(self.lag)
+
+    def _watch(self):
+        episode = None
+        while True:
+            time.sleep(self.threshold / 2)
+            heartbeat = self._heartbeat
+            stalled = time.monotonic() - heartbeat - self.interval
+
+            if stalled > self.threshold and (episode is None or episode[0] != heartbeat):
+                # The stack is sampled once, when a stall first crosses the threshold
+                if episode is not None:
+                    self._record(*episode[1:])
+                frame = sys._current_frames().get(self._loop_thread_id)
+                episode = [heartbeat, stalled, frame and traceback.extract_stack(frame, limit=8)]
+            elif stalled > self.threshold:
+                episode[1] = stalled
+            elif episode is not None:
+                self._record(*episode[1:])
+                episode = None
+
+    def _record(self, duration, stack):
+        if stack:
+            filename, line, function, _ = stack[-1]
+            location = f'{filename}:{line} in {function}'
+        else:
+            location = 'unknown'
+        blocker = Blocker(duration, datetime.utcnow(), location, ''.join(traceback.format_list(stack or [])))
+
+        with self._lock:
+            self.recent.append(blocker)
+            self.worst.append(blocker)
+            self.worst.sort(key=lambda b: b.duration, reverse=True)
+            del self.worst[self.size:]
+
+    def top(self, count):
+        with self._lock:
+            return list(self.worst[:count])
+
+
+watchdog = LoopWatchdog(threshold=config['bot'].get('watchdog_threshold', 0.25))
@@ -0,0 +1,134 @@
+import asyncio
+import io
+
+import aiohttp
+
+from bot import load_config
+from .cache import MISSING, TTLCache
+from .http import http_client, SingleFlight
+from .utils import caches, embed_message
+
+config = load_config()
+
+
+class WundergroundProvider:
+    """
+    Weather Underground API endpoints
+    """
+
+    def __init__(self, api_key, api_url='http://api.wunderground.com/api'):
+        self.api_key = api_key
+        self.api_url = api_url
+
+    async def fetch(self, endpoint, zip_code):
+        url = f'{self.api_url}/{self.api_key}/{endpoint}/q/{zip_code}.json'
+        async with http_client.get(url) as resp:
+            # Error pages are not necessarily JSON, and only the status is reported for them
+            data = await resp.json() if resp.status == 200 else None
+            return resp.status, data
+
+    @staticmethod
+    def location(data):
+        # Unknown zip codes still return 200, with an error in place of the observation
+        try:
+            return data['current_observation']['display_location']
+        except KeyError:
+            return {}
+
+    def radar_url(self, zip_code):
+        return f'{self.api_url}/{self.api_key}/radar/q/{zip_code}.png?newmaps=1&smooth=1&noclutter=1'
+
+    async def fetch_radar(self, zip_code, max_size):
+        async with http_client.get(self.radar_url(zip_code)) as resp:
+            if resp.status != 200:
+                return resp.status, None
+            if resp.content_length is not None and resp.content_length > max_size:
+                return 413, None
+
+            # Read in chunks so an oversized image is abandoned without being held in full
+            buffer = io.BytesIO()
+            async for chunk in resp.content.iter_chunked(65536):
+                buffer.write(chunk)
+                if buffer.tell() > max_size:
+                    return 413, None
+            return resp.status, buffer.getvalue()
+
+
+class WeatherClient:
+    """
+    Weather data layer caching responses per endpoint and coalescing requests by zip code
+    """
+
+    TTLS = {
+        'conditions': 300,
+        'forecast': 3600,
+        'alerts': 120
+    }
+    RADAR_MAX_SIZE = 4 * 1024 * 1024
+
+    def __init__(self, provider, ttls=None):
+        self.provider = provider
+        ttls = dict(self.TTLS, **(ttls or {}))
+        self.caches = {endpoint: TTLCache(maxsize=1000, ttl=ttl) for endpoint, ttl in ttls.items()}
+        # Zip code validity does not change, so it outlives the conditions it came from
+        self.locations = TTLCache(maxsize=5000, ttl=86400)
+        # Bursts of radar requests for one area reuse a single download
+        self.radar_images = TTLCache(maxsize=20, ttl=120)
+        self.flight = SingleFlight()
+
+    async def get(self, ctx, endpoint, zip_code):
+        cache = self.caches[endpoint]
+        data = cache.get(zip_code)
+        if data is not MISSING:
+            return data
+
+        try:
+            status, data = await self.flight.run((endpoint, zip_code), self.provider.fetch, endpoint, zip_code)
+        except (asyncio.TimeoutError, aiohttp.ServerTimeoutError):
+            await embed_message(ctx, message_type='Error', message='Connection Timeout')
+            return None
+
+        if status == 200:
+            cache.set(zip_code, data)
+            if endpoint == 'conditions':
+                self.locations.set(zip_code, self.provider.location(data))
+            return data
+        await embed_message(ctx, message_type='Error', message=f'Unexpected Error (status {status})')
+        return None
+
+    async def location(self, ctx, zip_code):
+        location = self.locations.get(zip_code)
+        if location is MISSING:
+            data = await self.get(ctx, 'conditions', zip_code)
+            location = self.provider.location(data) if data is not None else None
+        return location
+
+    async def radar(self, ctx, zip_code):
+        image = self.radar_images.get(zip_code)
+        if image is not MISSING:
+            return image
+
+        try:
+            status, image = await self.flight.run(
+                ('radar', zip_code), self.provider.fetch_radar, zip_code, self.RADAR_MAX_SIZE)
+        except (asyncio.TimeoutError, aiohttp.ServerTimeoutError):
+            await embed_message(ctx, message_type='Error', message='Connection Timeout')
+            return None
+
+        if status == 200:
+            self.radar_images.set(zip_code, image)
+            return image
+        elif status == 413:
+            await embed_message(ctx, message_type='Error', message='Radar image is too large')
+        else:
+            await embed_message(ctx, message_type='Error', message=f'Unexpected Error (status {status})')
+        return None
+
+
+weather = WeatherClient(WundergroundProvider(
+    config['wunderground']['key'],
+    config['wunderground'].get('api_url', 'http://api.wunderground.com/api')
+))
+caches.update({f'weather_{endpoint}': cache for endpoint, cache in weather.caches.items()})
+caches['weather_locations'] = weather.locations
+caches['weather_radar'] = weather.radar_images
@@ -0,0 +1,166 @@
+"""
+Local stand-in for the Twitch Helix API with a rate limited token bucket
+
+Point the bot at it with "api_url": "http://127.0.0.1:8767/helix" in the twitch config
+section. Every response carries Ratelimit-Limit, Ratelimit-Remaining and Ratelimit-Reset
+headers like Helix does, and requests beyond the bucket are answered with 429, so the
+bot's rate limiter can be watched keeping under the limit. A small bucket shows it quickly:
+
+    $ python scripts/fake_helix_server.py --limit 30 --period 60
+"""
+import argparse
+import math
+import time
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta
+
+from aiohttp import web
+
+responses = Counter()
+# Logins looked up by name keep that name when later looked up by ID
+logins = {}
+
+
+class Bucket:
+    """
+    Helix style token bucket refilled continuously over the period
+    """
+
+    def __init__(self, limit, period):
+        self.limit = limit
+        self.rate = limit / period
+        self.tokens = float(limit)
+        self._updated = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.limit, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def headers(self):
+        reset = time.time() + (self.limit - self.tokens) / self.rate
+        return {
+            'Ratelimit-Limit': str(self.limit),
+            'Ratelimit-Remaining': str(int(self.tokens)),
+            'Ratelimit-Reset': str(math.ceil(reset))
+        }
+
+
+def user_id(login):
+    channel_id = str(zlib.crc32(login.encode()) % 100000000)
+    logins[channel_id] = login
+    return channel_id
+
+
+def user(channel_id, login=None):
+    login = login or logins.get(channel_id, f'channel{channel_id}')
+    return {
+        'id': channel_id,
+        'login': login,
+        'display_name': login,
+        'broadcaster_type': 'partner' if int(channel_id) % 2 else '',
+        'description': f'Fake channel {login}',
+        'view_count': int(channel_id) % 1000000
+    }
+
+
+def stream(channel_id):
+    started_at = datetime.utcnow() - timedelta(minutes=int(channel_id) % 600)
+    return {
+        'id': str(int(channel_id) + 1),
+        'user_id': channel_id,
+        'user_name': logins.get(channel_id, f'channel{channel_id}'),
+        'game_id': str(int(channel_id) % 50 + 1),
+        'type': 'live',
+        'title': f'Fake stream {channel_id}',
+        'viewer_count': int(channel_id) % 50000,
+        'started_at': started_at.strftime('%Y-%m-%dT%H:%M:%SZ')
+    }
+
+
+def users(query):
+    data = [user(channel_id) for channel_id in query.getall('id', [])]
+    # Logins starting with "missing" do not exist, for exercising unknown channel replies
+    data += [user(user_id(login), login) for login in query.getall('login', []) if not login.startswith('missing')]
+    return {'data': data}
+
+
+def streams(query):
+    channel_ids = query.getall('user_id', [])
+    if not channel_ids:
+        channel_ids = [str(channel_id) for channel_id in range(1000, 1000 + int(query.get('first', 20)))]
+    # Two out of three channels are live
+    return {'data': [stream(channel_id) for channel_id in channel_ids if int(channel_id) % 3], 'pagination': {}}
+
+
+def games(query):
+    return {'data': [{'id': game_id, 'name': f'Game {game_id}'} for game_id in query.getall('id', [])]}
+
+
+def top_games(query):
+    first = int(query.get('first', 20))
+    return {'data': [{'id': str(game_id), 'name': f'Game {game_id}'} for game_id in range(1, first + 1)]}
+
+
+def follows(query):
+    if 'to_id' in query:
+        return {'total': int(query['to_id']) % 100000, 'data': [], 'pagination': {}}
+
+    # Every user follows 250 channels, returned a page at a time
+    offset = int(query.get('after') or 0)
+    first = int(query.get('first', 20))
+    to_ids = [str(2000 + index) for index in range(offset, min(250, offset + first))]
+    cursor = str(offset + first) if offset + first < 250 else None
+    return {
+        'total': 250,
+        'data': [{'from_id': query['from_id'], 'to_id': to_id} for to_id in to_ids],
+        'pagination': {'cursor': cursor} if cursor else {}
+    }
+
+
+ENDPOINTS = {
+    'users': users,
+    'streams': streams,
+    'games': games,
+    'games/top': top_games,
+    'users/follows': follows
+}
+
+
+def make_app(limit, period):
+    bucket = Bucket(limit, period)
+
+    async def handle(request):
+        endpoint = request.match_info['endpoint']
+        if not bucket.take():
+            responses[(endpoint, 429)] += 1
+            print(f'{endpoint} 429 ({responses[(endpoint, 429)]})')
+            return web.json_response(
+                {'error': 'Too Many Requests', 'status': 429, 'message': 'Request limit exceeded'},
+                status=429, headers=bucket.headers())
+        if endpoint not in ENDPOINTS:
+            return web.json_response(
+                {'error': 'Not Found', 'status': 404, 'message': ''}, status=404, headers=bucket.headers())
+
+        responses[(endpoint, 200)] += 1
+        print(f'{endpoint} 200 ({responses[(endpoint, 200)]}), {bucket.headers()["Ratelimit-Remaining"]} remaining')
+        return web.json_response(ENDPOINTS[endpoint](request.query), headers=bucket.headers())
+
+    app = web.Application()
+    app.router.add_get('/helix/{endpoint:.+}', handle)
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8767)
+    parser.add_argument('--limit', type=int, default=800)
+    parser.add_argument('--period', type=float, default=60)
+    args = parser.parse_args()
+    web.run_app(make_app(args.limit, args.period), host=args.host, port=args.port)
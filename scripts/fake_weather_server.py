@@ -0,0 +1,97 @@
+"""
+Local stand-in for the Weather Underground API used by core.weather
+
+Point the bot at it with "api_url": "http://127.0.0.1:8766" in the wunderground config
+section. Every request is logged with a running count per path, so caching and request
+coalescing show up as missing requests. Zip code 00000 is answered as unknown:
+
+    $ python scripts/fake_weather_server.py --delay 0.5
+"""
+import argparse
+import asyncio
+import struct
+import zlib
+from collections import Counter
+
+from aiohttp import web
+
+requests = Counter()
+
+
+def png(size):
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    image = b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', 1, 1, 8, 2, 0, 0, 0))
+    image += chunk(b'IDAT', zlib.compress(b'\x00\x00\x00\xff')) + chunk(b'IEND', b'')
+    # Trailing padding is ignored by image readers and makes the size cap testable
+    return image + b'\x00' * max(0, size - len(image))
+
+
+def conditions(zip_code):
+    return {
+        'current_observation': {
+            'display_location': {'full': 'Springfield, IL', 'zip': zip_code},
+            'weather': 'Partly Cloudy',
+            'temperature_string': '72.0 F (22.2 C)',
+            'wind_string': 'From the SW at 5.0 MPH',
+            'relative_humidity': '45%',
+            'precip_today_string': '0.00 in (0 mm)'
+        }
+    }
+
+
+def forecast(zip_code):
+    days = ['Monday', 'Monday Night', 'Tuesday', 'Tuesday Night', 'Wednesday', 'Wednesday Night']
+    return {
+        'forecast': {
+            'txt_forecast': {
+                'forecastday': [{'title': day, 'fcttext': f'Forecast for {zip_code}.'} for day in days]
+            }
+        }
+    }
+
+
+def alerts(zip_code):
+    return {'alerts': [{'description': 'Heat Advisory'}]}
+
+
+ENDPOINTS = {
+    'conditions': conditions,
+    'forecast': forecast,
+    'alerts': alerts
+}
+
+
+def make_app(delay, radar_size):
+    radar_image = png(radar_size)
+
+    async def handle(request):
+        requests[request.path] += 1
+        print(f'{request.path} ({requests[request.path]})')
+        await asyncio.sleep(delay)
+
+        endpoint = request.match_info['endpoint']
+        zip_code, extension = request.match_info['query'].rsplit('.', 1)
+        if endpoint == 'radar' and extension == 'png':
+            return web.Response(body=radar_image, content_type='image/png')
+        if endpoint not in ENDPOINTS:
+            return web.Response(status=404)
+        if zip_code == '00000':
+            return web.json_response({'response': {'error': {'type': 'querynotfound'}}})
+        return web.json_response(ENDPOINTS[endpoint](zip_code))
+
+    app = web.Application()
+    app.router.add_get('/{key}/{endpoint}/q/{query}', handle)
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8766)
+    # A response delay widens the window in which concurrent requests are coalesced
+    parser.add_argument('--delay', type=float, default=0.0)
+    parser.add_argument('--radar-size', type=int, default=0)
+    args = parser.parse_args()
+    web.run_app(make_app(args.delay, args.radar_size), host=args.host, port=args.port)
@@ -0,0 +1,110 @@
+"""
+Seed a follows table and time per-user follow lookups with and without the user-009 indexes
+
+Also builds the follower index with the streaming scan over the seeded table and reports its
+build time and estimated memory. Run from the bot directory, since core.models reads config.json. Rows are seeded into a
+temporary database, not bot.db:
+
+    $ python scripts/follows_benchmark.py --rows 1000000 --lookups 1000
+"""
+import argparse
+import asyncio
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core import db, models  # noqa: E402
+from core.follows import FollowIndex, FollowerIndex  # noqa: E402
+from core.migrations import MIGRATIONS  # noqa: E402
+
+
+def seed(engine, rows, per_user):
+    users = max(1, rows // per_user)
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.executemany(
+            'INSERT INTO follows (user_id, username, channel, channel_id) VALUES (?, ?, ?, ?)',
+            (
+                (100000000000000000 + number % users, f'user{number % users}',
+                 f'channel{number // users}', 10000000 + number // users)
+                for number in range(rows)
+            )
+        )
+        connection.commit()
+    finally:
+        connection.close()
+    return users
+
+
+async def time_lookups(lookup, user_ids):
+    timings = []
+    for user_id in user_ids:
+        start = time.perf_counter()
+        await lookup(user_id)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    return statistics.median(timings) * 1000, p99 * 1000
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f'sqlite:///{os.path.join(directory, "follows.db")}')
+        models.Base.metadata.create_all(engine)
+        models.Session.configure(bind=engine)
+        # The table starts out as it was before user-009, with only the primary key
+        for index in models.Follows.__table__.indexes:
+            index.drop(engine)
+
+        start = time.perf_counter()
+        users = seed(engine, args.rows, args.per_user)
+        print(f'Seeded {args.rows} follows for {users} users in {time.perf_counter() - start:.1f} s')
+
+        user_ids = [100000000000000000 + random.randrange(users) for _ in range(args.lookups)]
+        p50, p99 = await time_lookups(db.get_follow_records, user_ids)
+        print(f'{"no indexes":<20} p50 {p50:8.2f} ms  p99 {p99:8.2f} ms')
+
+        start = time.perf_counter()
+        with engine.begin() as connection:
+            for statement in MIGRATIONS[0]:
+                connection.execute(statement)
+        print(f'Migration built the indexes in {time.perf_counter() - start:.1f} s')
+        p50, p99 = await time_lookups(db.get_follow_records, user_ids)
+        print(f'{"indexed":<20} p50 {p50:8.2f} ms  p99 {p99:8.2f} ms')
+
+        # check_follows_exist itself reads through the per-user follow index
+        index = FollowIndex(maxsize=users)
+        await time_lookups(index.get, user_ids)
+        p50, p99 = await time_lookups(index.get, user_ids)
+        print(f'{"warm follow index":<20} p50 {p50:8.3f} ms  p99 {p99:8.3f} ms')
+
+        # The reverse index is built the way the bot builds it, by streaming the table through scan_follows
+        follower_index = FollowerIndex()
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.perf_counter()
+        await follower_index.build()
+        elapsed = time.perf_counter() - start
+        size = FollowerIndex.memory_usage(follower_index.followers, follower_index.channels)
+        growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss
+        print(
+            f'Built follower index over {len(follower_index.followers)} channels in {elapsed:.1f} s, '
+            f'memory_usage() {size / 1024 / 1024:.1f} MiB, peak RSS grew {growth / 1024:.1f} MiB'
+        )
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--per-user', type=int, default=50)
+    parser.add_argument('--lookups', type=int, default=1000)
+    asyncio.get_event_loop().run_until_complete(main(parser.parse_args()))
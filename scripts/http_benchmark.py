@@ -0,0 +1,82 @@
+"""
+Per-request latency of a new aiohttp session per request against the shared pooled client
+
+Starts a local stub server and times sequential GET requests both ways:
+
+    $ python scripts/http_benchmark.py --requests 500
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.http import HTTPClient  # noqa: E402
+
+
+async def handle(request):
+    return web.json_response({'data': []})
+
+
+async def start_stub(port):
+    app = web.Application()
+    app.router.add_get('/helix/streams', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    return runner
+
+
+async def session_per_request(url, count):
+    timings = []
+    for _ in range(count):
+        start = time.perf_counter()
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url, timeout=60) as resp:
+                await resp.json()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+async def shared_client(url, count):
+    client = HTTPClient()
+    timings = []
+    try:
+        for _ in range(count):
+            start = time.perf_counter()
+            async with client.get(url) as resp:
+                await resp.json()
+            timings.append(time.perf_counter() - start)
+    finally:
+        await client.close()
+    return timings
+
+
+def report(name, timings):
+    timings = sorted(timings)
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    print(f'{name:<22} mean {statistics.mean(timings) * 1000:7.3f} ms  '
+          f'p50 {statistics.median(timings) * 1000:7.3f} ms  p99 {p99 * 1000:7.3f} ms')
+
+
+async def main(args):
+    runner = await start_stub(args.port)
+    url = f'http://127.0.0.1:{args.port}/helix/streams'
+    try:
+        report('session per request', await session_per_request(url, args.requests))
+        report('shared pooled client', await shared_client(url, args.requests))
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--port', type=int, default=8765)
+    asyncio.get_event_loop().run_until_complete(main(parser.parse_args()))
@@ -0,0 +1,82 @@
+"""
+Event loop lag under concurrent follow writes, blocking sessions against the core.db executor
+
+Run from the bot directory, since core.models reads config.json. Writes go to temporary
+databases, not bot.db:
+
+    $ python scripts/loop_lag_benchmark.py --writers 50 --writes 20
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core import db, models  # noqa: E402
+
+
+def follow(writer, number):
+    return {'user_id': writer, 'username': f'user{writer}', 'channel': f'channel{number}', 'channel_id': number}
+
+
+async def blocking_writer(writer, count):
+    # The pattern before core.db: sessions used directly on the event loop, one commit per row
+    for number in range(count):
+        session = models.Session()
+        session.add(models.Follows(**follow(writer, number)))
+        session.commit()
+        session.close()
+        await asyncio.sleep(0)
+
+
+async def executor_writer(writer, count):
+    for number in range(count):
+        await db.insert_follows([follow(writer, number)])
+
+
+async def heartbeat(lags, stop, interval=0.01):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, time.perf_counter() - start - interval))
+
+
+async def measure(name, writer, directory, args):
+    engine = create_engine(f'sqlite:///{os.path.join(directory, name)}.db', connect_args={'check_same_thread': False})
+    models.Base.metadata.create_all(engine)
+    models.Session.configure(bind=engine)
+
+    lags = []
+    stop = asyncio.Event()
+    beat = asyncio.ensure_future(heartbeat(lags, stop))
+    start = time.perf_counter()
+    await asyncio.gather(*[writer(number, args.writes) for number in range(args.writers)])
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await beat
+
+    lags.sort()
+    p99 = lags[min(len(lags) - 1, int(len(lags) * 0.99))] if lags else 0.0
+    print(f'{name:<9} {args.writers * args.writes} writes in {elapsed:6.2f} s  '
+          f'loop lag p50 {statistics.median(lags or [0]) * 1000:7.1f} ms  '
+          f'p99 {p99 * 1000:7.1f} ms  max {max(lags or [0]) * 1000:7.1f} ms')
+    engine.dispose()
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as directory:
+        await measure('blocking', blocking_writer, directory, args)
+        await measure('executor', executor_writer, directory, args)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--writers', type=int, default=50)
+    parser.add_argument('--writes', type=int, default=20)
+    asyncio.get_event_loop().run_until_complete(main(parser.parse_args()))
@@ -0,0 +1,89 @@
+"""
+Scrape the metrics endpoint without a Discord connection and check the exposition output
+
+Starts core.metrics.start_server on an ephemeral port with a few sample metrics registered,
+GETs /metrics and checks the content type, HELP and TYPE lines, label escaping and
+histogram series. Exits non-zero on the first failed check:
+
+    $ python scripts/metrics_check.py
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core import metrics  # noqa: E402
+
+EXPECTED = [
+    '# HELP check_requests_total Requests seen by the check',
+    '# TYPE check_requests_total counter',
+    'check_requests_total{endpoint="streams"} 3',
+    'check_requests_total{endpoint="say \\"hi\\"\\nback\\\\slash"} 1',
+    '# TYPE check_queue_depth gauge',
+    'check_queue_depth 7',
+    '# TYPE check_latency_seconds histogram',
+    'check_latency_seconds_bucket{endpoint="streams",le="0.1"} 1',
+    'check_latency_seconds_bucket{endpoint="streams",le="1.0"} 2',
+    'check_latency_seconds_bucket{endpoint="streams",le="+Inf"} 3',
+    'check_latency_seconds_sum{endpoint="streams"} 5.55',
+    'check_latency_seconds_count{endpoint="streams"} 3',
+    '# TYPE check_cache_entries gauge',
+    'check_cache_entries{cache="channel_ids"} 42'
+]
+
+
+def register_samples():
+    requests = metrics.Counter('check_requests_total', 'Requests seen by the check', ['endpoint'])
+    requests.inc('streams', amount=3)
+    requests.inc('say "hi"\nback\\slash')
+    metrics.Gauge('check_queue_depth', 'Queued requests').set(7)
+    latency = metrics.Histogram('check_latency_seconds', 'Request latency', ['endpoint'], buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        latency.observe(value, 'streams')
+    metrics.Gauge(
+        'check_cache_entries', 'Entries per cache', ['cache'], callback=lambda: {('channel_ids',): 42})
+
+
+async def main(args):
+    register_samples()
+    runner = await metrics.start_server(args.host, 0)
+    try:
+        host, port = runner.addresses[0][:2]
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f'http://{host}:{port}/metrics') as resp:
+                status = resp.status
+                content_type = resp.headers.get('Content-Type', '')
+                body = await resp.text()
+    finally:
+        await runner.cleanup()
+
+    print(body)
+    lines = body.splitlines()
+    failures = []
+    if status != 200:
+        failures.append(f'status {status}, expected 200')
+    if not content_type.startswith('text/plain; version=0.0.4'):
+        failures.append(f'content type {content_type!r}')
+    if not body.endswith('\n'):
+        failures.append('body does not end with a newline')
+    failures.extend(f'missing line: {line}' for line in EXPECTED if line not in lines)
+    # Metrics registered by core.metrics itself render too, each with a HELP and a TYPE line
+    helps = sum(line.startswith('# HELP ') for line in lines)
+    types = sum(line.startswith('# TYPE ') for line in lines)
+    if helps != types:
+        failures.append(f'{helps} HELP lines but {types} TYPE lines')
+
+    for failure in failures:
+        print(f'FAIL {failure}')
+    print(f'{len(failures)} failed checks scraping port {port}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    sys.exit(asyncio.get_event_loop().run_until_complete(main(parser.parse_args())))
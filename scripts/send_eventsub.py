@@ -0,0 +1,70 @@
+"""
+POST signed fake EventSub messages to the bot's webhook receiver
+
+Sends a callback verification, or a stream.online / stream.offline notification,
+signed with the configured secret the same way Twitch signs them:
+
+    $ python scripts/send_eventsub.py --secret s3cret verify
+    $ python scripts/send_eventsub.py --secret s3cret online --broadcaster-id 12826 --login twitch
+    $ python scripts/send_eventsub.py --secret s3cret offline --broadcaster-id 12826 --login twitch
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import uuid
+from datetime import datetime
+
+import aiohttp
+
+
+def build_message(kind, broadcaster_id, login):
+    event_type = 'stream.offline' if kind == 'offline' else 'stream.online'
+    subscription = {
+        'id': str(uuid.uuid4()),
+        'type': event_type,
+        'version': '1',
+        'status': 'enabled',
+        'condition': {'broadcaster_user_id': broadcaster_id},
+        'created_at': datetime.utcnow().isoformat() + 'Z'
+    }
+    if kind == 'verify':
+        return 'webhook_callback_verification', {'subscription': subscription, 'challenge': uuid.uuid4().hex}
+
+    event = {'broadcaster_user_id': broadcaster_id, 'broadcaster_user_login': login, 'broadcaster_user_name': login}
+    if kind == 'online':
+        event.update({'id': str(uuid.uuid4()), 'type': 'live', 'started_at': datetime.utcnow().isoformat() + 'Z'})
+    return 'notification', {'subscription': subscription, 'event': event}
+
+
+async def main(args):
+    message_type, payload = build_message(args.kind, args.broadcaster_id, args.login)
+    body = json.dumps(payload).encode('utf-8')
+    message_id = str(uuid.uuid4())
+    timestamp = datetime.utcnow().isoformat() + 'Z'
+    signature = hmac.new(args.secret.encode(), message_id.encode() + timestamp.encode() + body, hashlib.sha256)
+
+    headers = {
+        'Content-Type': 'application/json',
+        'Twitch-Eventsub-Message-Id': message_id,
+        'Twitch-Eventsub-Message-Timestamp': timestamp,
+        'Twitch-Eventsub-Message-Signature': 'sha256=' + signature.hexdigest(),
+        'Twitch-Eventsub-Message-Type': message_type
+    }
+    async with aiohttp.ClientSession() as session:
+        for _ in range(args.repeat):
+            async with session.post(args.url, data=body, headers=headers) as resp:
+                print(f'{message_type}: {resp.status} {await resp.text()}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('kind', choices=['verify', 'online', 'offline'])
+    parser.add_argument('--url', default='http://127.0.0.1:8080/eventsub')
+    parser.add_argument('--secret', required=True)
+    parser.add_argument('--broadcaster-id', default='12826')
+    parser.add_argument('--login', default='twitch')
+    # Repeating the same message id exercises duplicate delivery handling
+    parser.add_argument('--repeat', type=int, default=1)
+    asyncio.get_event_loop().run_until_complete(main(parser.parse_args()))
@@ -0,0 +1,40 @@
+"""
+Run the shard supervisor with stub workers that crash once, without connecting to Discord
+
+Each stub worker prints its shard range, exits with an error on its first start and cleanly
+after the restart, so the split, the restart and the shutdown paths are all exercised.
+Run from the bot directory, since the supervisor prepares the follows schema first:
+
+    $ python scripts/supervisor_smoke.py --shards 10 --processes 3
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.supervisor import Supervisor  # noqa: E402
+
+
+def stub_worker(worker, shard_ids, shard_count):
+    marker = os.path.join(os.environ['SMOKE_DIRECTORY'], f'worker-{worker}')
+    print(f'Worker {worker} (pid {os.getpid()}) running shards {shard_ids} of {shard_count}')
+    time.sleep(1)
+    if not os.path.exists(marker):
+        open(marker, 'w').close()
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--shards', type=int, default=10)
+    parser.add_argument('--processes', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Spawned workers inherit the environment, which is how they find the marker files
+        os.environ['SMOKE_DIRECTORY'] = directory
+        Supervisor(stub_worker, args.shards, args.processes, restart_delay=1).run()
+    print('All workers exited cleanly')